@@ -1,13 +1,31 @@
 # encoding=utf-8
 from collections import OrderedDict, Iterable
+from decimal import Decimal
 from functools import update_wrapper
-import json
+import hashlib
+import time
+from time import perf_counter
 
+import django
+from django.db import transaction
 from django.db.models.query import QuerySet
 from django.http.response import HttpResponseNotAllowed, HttpResponse, Http404, \
-    HttpResponseBadRequest
+    HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
 from django.views.decorators.csrf import csrf_exempt
 
+from jsonapi.accessors import compile_fields, lookup
+from jsonapi.context import get_context
+from jsonapi.instrumentation import PhaseTimer, QueryCounter, QueryBudgetExceeded, NULL_TIMER, \
+    format_server_timing, logger
+from jsonapi.encoders import get_encoder, get_decoder
+from jsonapi.lrucache import LRUCache
+
+
+if django.VERSION < (3, 2):
+    # Django >= 3.2 はapps.pyのAppConfigを自動的に用いる
+    default_app_config = "jsonapi.apps.JSONAPIConfig"
+
 
 class JSONAPI(object):
 
@@ -20,23 +38,85 @@ class JSONAPI(object):
 
     content_type = "application/json"
 
+    # JSONのエンコーダとデコーダ ("auto", "orjson", "ujson", "json")
+    # "auto"のエンコーダは出力のバイト列(ensure_asciiや区切り文字)が変わるため、エンコーダは"json"を既定とする
+    json_encoder = "json"
+    json_decoder = "auto"
+
+    # リクエストボディの最大バイト数と、一度に追加・変更できる最大件数 (Noneは無制限)
+    max_body_size = None
+    max_items = None
+
+    # 一覧へのPUT/PATCHでまとめて変更する
+    allow_bulk_change = False
+    # 一覧へのDELETEでまとめて削除する
+    allow_bulk_delete = False
+
+    # 全てのレスポンスのmetaに含める値 (リクエストごとの値はget_contextのmetaに追加する)
     metadata = {}
 
+    # 一覧をStreamingHttpResponseで少しずつ返す
+    streaming = False
+    stream_chunk_size = 1000
+
+    # fields=パラメータごとのコンパイル結果などをクラスごとに保持する件数
+    class_cache_size = 128
+
+    # get_item_by_idでidの索引を用いる
+    id_index = False
+    _id_index = None
+
+    # GETのレスポンスをキャッシュする秒数 (Noneはキャッシュしない)
+    cache_timeout = None
+    cache_alias = "default"
+    # キャッシュのキーの先頭に付ける名前 (Noneの場合はクラスのモジュールと名前)
+    cache_prefix = None
+
+    # 一覧の行ごとのJSONをキャッシュする秒数 (Noneはキャッシュしない)
+    row_cache_timeout = None
+    # 行のバージョンとして用いる属性 ("updated_at"など)
+    # Noneの場合はitems_changedで全ての行のキャッシュを無効にする
+    row_version_field = None
+
+    # 計測結果を受け取るObserverのリスト (jsonapi.instrumentation.Observer)
+    observers = ()
+    # 計測結果をServer-Timingヘッダで返す
+    server_timing = False
+
+    # 一覧の取得、1件の取得、追加で実行してよいクエリ数 (Noneは制限しない)
+    # 制限した場合はX-Query-Countヘッダでクエリ数を返す
+    # ストリーミングの場合はヘッダを返さず、本文を送信し終えた時点で判定する
+    max_queries_index = None
+    max_queries_item = None
+    max_queries_post = None
+    # クエリ数を超えた場合の動作 ("log": 警告を出力する, "raise": QueryBudgetExceededを送出する)
+    query_budget_action = "log"
+
     def wrap_view(self, view_func):
         return csrf_exempt(view_func)
 
     def get_urls(self):
-        from django.conf.urls import patterns, url
-
-        urlpatterns = patterns('',
-            url(r'^$',
-                self.wrap_view(self.request_index),
-                name='%s_index' % self.model_name),
-            url(r'^(.+)/$',
-                self.wrap_view(self.request_item),
-                name='%s_item' % self.model_name),
-        )
-        return urlpatterns
+        try:
+            from django.urls import path
+        except ImportError:  # Django < 2.0
+            from django.conf.urls import url
+            return [
+                url(r'^$',
+                    self.wrap_view(self.request_index),
+                    name='%s_index' % self.model_name),
+                url(r'^(.+)/$',
+                    self.wrap_view(self.request_item),
+                    name='%s_item' % self.model_name),
+            ]
+
+        return [
+            path("",
+                 self.wrap_view(self.request_index),
+                 name='%s_index' % self.model_name),
+            path("<%s:id>/" % self.get_id_converter(),
+                 self.wrap_view(self.request_item),
+                 name='%s_item' % self.model_name),
+        ]
 
     def urls(self):
         return self.get_urls()
@@ -45,42 +125,338 @@ class JSONAPI(object):
     """リクエストの処理関係"""
 
     def request_index(self, request):
+        return self._instrument(request, self._dispatch_index)
+
+    def request_item(self, request, id):
+        return self._instrument(request, self._dispatch_item, id)
+
+    def _dispatch_index(self, request):
         if request.method == "GET":
-            return self.get_index(request)
+            return self._cached_response(request, self.get_index)
         if request.method == "POST":
             # ADD
             return self.post_index(request)
+        if request.method in ("PUT", "PATCH") and self.allow_bulk_change:
+            return self.put_index(request)
+        if request.method == "DELETE" and self.allow_bulk_delete:
+            return self.delete_index(request)
         return HttpResponseNotAllowed("")
 
-    def request_item(self, request, id):
+    def _dispatch_item(self, request, id):
         if request.method == "GET":
-            return self.get_item(request, id)
+            return self._cached_response(request, self.get_item, id)
         if request.method == "PUT":
             return self.put_item(request, id)
         if request.method == "DELETE":
             return self.delete_item(request, id)
         return HttpResponseNotAllowed("")
 
+    # 計測
+    def _is_instrumented(self):
+        return bool(self.observers or self.server_timing)
+
+    def _phase(self, request, name):
+        """処理時間を計測するコンテキストマネージャを返す (計測しない場合は何もしない)"""
+        if request is None or not self._is_instrumented():
+            return NULL_TIMER
+        return PhaseTimer(self.get_context(request).timings, name)
+
+    def _set_stat(self, request, name, value):
+        if request is not None and self._is_instrumented():
+            self.get_context(request).stats[name] = value
+
+    def get_query_budget(self, request, id=None):
+        """リクエストで実行してよいクエリ数を返す (Noneは制限しない)"""
+        if request.method == "GET":
+            return self.max_queries_index if id is None else self.max_queries_item
+        if request.method == "POST" and id is None:
+            return self.max_queries_post
+        return None
+
+    def _instrument(self, request, view, *args):
+        """viewを呼び出し、計測結果をヘッダとObserverに渡す"""
+        budget = self.get_query_budget(request, *args)
+        instrumented = self._is_instrumented()
+        if budget is None and not instrumented:
+            return view(request, *args)
+
+        start = perf_counter()
+        queries = QueryCounter()
+        with queries:
+            response = view(request, *args)
+        if response.streaming:
+            # 本文のクエリは送信しながら実行されるため、送信し終えるまで数える
+            response.streaming_content = self._iter_counting_queries(
+                request, response, response.streaming_content, queries, budget, start)
+            return response
+        self._queries_finished(request, response, queries, budget, start)
+        return response
+
+    def _iter_counting_queries(self, request, response, content, queries, budget, start):
+        content = iter(content)
+        size = 0
+        while True:
+            with queries:
+                try:
+                    chunk = next(content)
+                except StopIteration:
+                    break
+            if budget is not None and queries.count > budget and self.query_budget_action == "raise":
+                # 制限を超えた時点で送信を中断する
+                self._query_budget_exceeded(request, queries.count, budget)
+            size += len(chunk)
+            yield chunk
+        self._set_stat(request, "bytes", size)
+        self._queries_finished(request, response, queries, budget, start)
+
+    def _queries_finished(self, request, response, queries, budget, start):
+        """クエリ数を判定し、計測結果をヘッダとObserverに渡す"""
+        if budget is not None:
+            if not response.streaming:
+                response["X-Query-Count"] = str(queries.count)
+            if queries.count > budget:
+                self._query_budget_exceeded(request, queries.count, budget)
+        if self._is_instrumented():
+            context = self.get_context(request)
+            context.timings["db"] = queries.time
+            context.timings["total"] = perf_counter() - start
+            context.stats["queries"] = queries.count
+            self._finish_instrumentation(request, context, response)
+
+    def _query_budget_exceeded(self, request, count, budget):
+        message = "%s %s executed %d queries (max %d) in %s" % (
+            request.method, request.path, count, budget, type(self).__name__)
+        if self.query_budget_action == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    def _finish_instrumentation(self, request, context, response):
+        if not response.streaming:
+            context.stats["bytes"] = len(response.content)
+        if self.server_timing and not response.streaming:
+            # ストリーミングの場合はヘッダを送信済み
+            response["Server-Timing"] = format_server_timing(context)
+        for observer in self.observers:
+            observer.request_finished(self, request, context, response)
+
+    # キャッシュ
+    def _get_cache(self):
+        try:
+            from django.core.cache import caches
+        except ImportError:
+            # Django < 1.7
+            from django.core.cache import get_cache
+            return get_cache(self.cache_alias)
+        return caches[self.cache_alias]
+
+    def get_cache_prefix(self):
+        """キャッシュのキーの名前空間を返す (同じmodel_nameのAPIを区別する)"""
+        if self.cache_prefix is not None:
+            return self.cache_prefix
+        cls = type(self)
+        return "%s.%s" % (cls.__module__, getattr(cls, "__qualname__", cls.__name__))
+
+    def get_cache_version_namespace(self):
+        """キャッシュを無効にする単位を返す
+
+        同じデータを扱うAPIは同じ値を返すこと (どれかで変更するとすべてのキャッシュが無効になる)
+        """
+        return self.get_cache_prefix()
+
+    def _get_cache_version_key(self):
+        return "jsonapi:version:%s" % self.get_cache_version_namespace()
+
+    def _get_cache_version(self, cache):
+        """データのバージョン (最後に変更された時刻のマイクロ秒) を返す"""
+        key = self._get_cache_version_key()
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, int(time.time() * 1000000), None)
+            version = cache.get(key)
+        return version
+
+    def get_cache_key(self, request, id=None):
+        """レスポンスをキャッシュするキーを返す (Noneの場合はキャッシュしない)
+
+        リクエストしたユーザーによって結果が変わる場合はオーバーライドすること
+        """
+        params = sorted((key, sorted(request.GET.getlist(key))) for key in request.GET)
+        return "%s:%s:%r" % (self.get_cache_prefix(), id, params)
+
+    def _in_atomic_batch(self, request):
+        """コミット前のデータを読み書きするリクエスト (atomicなバッチの操作) か
+
+        ロールバックされうる内容をキャッシュに残さないため、キャッシュを使わない
+        """
+        return getattr(request, "_jsonapi_atomic_batch", False)
+
+    def _is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            etags = [e.strip() for e in if_none_match.split(",")]
+            return "*" in etags or etag in etags or "W/" + etag in etags
+
+        if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE") or "")
+        return if_modified_since is not None and last_modified <= if_modified_since
+
+    def _get_cache_state(self, request, *args):
+        """(キャッシュ, ETag, 最終更新時刻, レスポンスのキー) を返す (キャッシュしない場合はNone)"""
+        if self.cache_timeout is None or self._in_atomic_batch(request):
+            return None
+        key = self.get_cache_key(request, *args)
+        if key is None:
+            return None
+
+        cache = self._get_cache()
+        version = self._get_cache_version(cache)
+        digest = hashlib.md5(("%s:%s" % (key, version)).encode("utf-8")).hexdigest()
+        return cache, '"%s"' % digest, version // 1000000, "jsonapi:response:%s" % digest
+
+    def _get_cached_response(self, request, state):
+        """304またはキャッシュしたレスポンスを返す (キャッシュがなければNone)"""
+        cache, etag, last_modified, cache_key = state
+        if self._is_not_modified(request, etag, last_modified):
+            # シリアライズを行わない
+            return HttpResponseNotModified()
+        content = cache.get(cache_key)
+        if content is not None:
+            return HttpResponse(content, content_type=self.content_type)
+        return None
+
+    def _store_response(self, state, response):
+        cache, etag, last_modified, cache_key = state
+        if not response.streaming:
+            cache.set(cache_key, response.content, self.cache_timeout)
+
+    def _set_cache_headers(self, state, response):
+        cache, etag, last_modified, cache_key = state
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def _cached_response(self, request, view, *args):
+        """キャッシュしたレスポンスを返すか、viewを呼び出してキャッシュする"""
+        state = self._get_cache_state(request, *args)
+        if state is None:
+            return view(request, *args)
+
+        response = self._get_cached_response(request, state)
+        if response is None:
+            response = view(request, *args)
+            if response.status_code != 200:
+                return response
+            self._store_response(state, response)
+        return self._set_cache_headers(state, response)
 
     # 取得系
     def get_index(self, request):
-        items = self.get_items_for_request(request)
-        return self.response(self._items_to_dict(items))
+        fields = self.get_fields(request)
+        if isinstance(fields, HttpResponse):
+            return fields
+        includes = self.get_includes(request)
+        if isinstance(includes, HttpResponse):
+            return includes
+        with self._phase(request, "query"):
+            items = self.get_items_for_request(request)
+        if isinstance(items, HttpResponse):
+            return items  # Generate HttpResponse by "get_items_for_request"
+        if self.streaming and not includes:
+            return self.streaming_response(items, fields, request)
+        if self.row_cache_timeout is not None and not includes and not self._in_atomic_batch(request):
+            # キャッシュした行のJSONをつなぎ合わせる
+            with self._phase(request, "serialize"):
+                content = b"".join(self._iter_index_json(items, fields, request))
+            return HttpResponse(content, content_type=self.content_type)
+
+        with self._phase(request, "query"):
+            # QuerySetはここで評価し、シリアライズの時間に含めない
+            rows, row_to_dict = self._fetch_rows(items, fields, includes)
+        with self._phase(request, "serialize"):
+            data = OrderedDict()
+            data[self.model_name] = [row_to_dict(row) for row in rows]
+            if includes:
+                # 関連するデータを"linked"に含める
+                data["linked"] = self.get_linked(request, rows, includes)
+        self._set_stat(request, "rows", len(data[self.model_name]))
+        return self.response(data, request)
 
     def get_item(self, request, id):
-        item = self.get_item_by_id(request, id)
+        fields = self.get_fields(request)
+        if isinstance(fields, HttpResponse):
+            return fields
+        includes = self.get_includes(request)
+        if isinstance(includes, HttpResponse):
+            return includes
+        with self._phase(request, "query"):
+            item = self.get_item_by_id(request, id)
         if item is None:
             raise Http404()
-        return self.response(self._items_to_dict(item))
+        with self._phase(request, "serialize"):
+            data = self._items_to_dict(item, fields)
+            if includes:
+                data["linked"] = self.get_linked(request, item, includes)
+        return self.response(data, request)
+
+    def get_fields(self, request):
+        """`fields`パラメータで指定された属性だけの`fields`を返す
+
+        パラメータがない場合は`fields`をそのまま返す
+        """
+        names = request.GET.get("fields")
+        if not names:
+            return self.fields
+        names = set(name.strip() for name in names.split(",") if name.strip())
+
+        fields = []
+        for accessor, field in zip(self._get_field_plan(), self.fields):
+            if accessor.name in names:
+                fields.append(field)
+                names.discard(accessor.name)
+        if names or not fields:
+            return HttpResponseBadRequest("Unknown fields: %s" % ",".join(sorted(names)))
+        return tuple(fields)
+
+    def get_includes(self, request):
+        """`include`パラメータで指定された関連データのリストを返す"""
+        if request.GET.get("include"):
+            return HttpResponseBadRequest("Include is not supported")
+        return ()
+
+    def get_linked(self, request, items, includes):
+        """`get_includes`で指定された関連データを{名前: データのリスト}の辞書で返す
+
+        一覧では`items`に`_fetch_rows`で取得した行のリストが渡される
+        """
+        return OrderedDict()
 
     # ADD
     def post_index(self, request):
+        with self._phase(request, "validate"):
+            forms = self._get_add_forms(request)
+        if isinstance(forms, HttpResponse):
+            return forms
 
+        # 新規登録処理を行う
+        with self._phase(request, "save"):
+            items = self.process_add_items(request, forms)
+        if isinstance(items, HttpResponse):
+            return items  # Generate HttpResponse by "process_add_items"
+        self.items_changed()
+
+        # 保存したItemをレスポンスとして返す
+        with self._phase(request, "serialize"):
+            data = self._items_to_dict(items)
+        return self.response(data, request)
+
+    def _get_add_forms(self, request):
+        """リクエストボディからバリデーション済みのフォームのリストを作る (エラーの場合はHttpResponse)"""
         if self.add_form is None:
             # フォームが用意されていない場合には追加できない
             return HttpResponseNotAllowed("")
 
         payload = self._get_json_payload(request)
+        if isinstance(payload, HttpResponse):
+            return payload
         if payload is None or self.model_name not in payload:
             return HttpResponseBadRequest("Bad struct")
 
@@ -92,6 +468,9 @@ class JSONAPI(object):
             # 全て配列にしておく
             items_data = [items_data]
 
+        if self.max_items is not None and len(items_data) > self.max_items:
+            return HttpResponse("Too many items", status=413)
+
         # Formでバリデーションを行う
         forms = []
         all_is_valid = True
@@ -103,129 +482,383 @@ class JSONAPI(object):
 
         if not all_is_valid:
             # バリデーションエラーレスポンス
-            error_list = [form.errors for form in forms]
-            response = self.response(error_list)
+            error_list = [self._get_form_errors(form) for form in forms]
+            response = self.response(error_list, request)
             response.status_code = 400
             return response
-
-        # 新規登録処理を行う
-        items = self.process_add_items(request, forms)
-        if isinstance(items, HttpResponse):
-            return items  # Generate HttpResponse by "process_add_items"
-
-        # 保存したItemをレスポンスとして返す
-        return self.response(self._items_to_dict(items))
+        return forms
 
     def get_change_form(self, request, item, data):
         FormClass = self.change_form
         return FormClass(data, initial=item)
 
+    def put_index(self, request):
+        """複数のItemをまとめて変更する"""
+
+        if self.change_form is None:
+            # フォームが用意されていない場合には変更できない
+            return HttpResponseNotAllowed("")
+
+        payload = self._get_json_payload(request)
+        if isinstance(payload, HttpResponse):
+            return payload
+        if payload is None or self.model_name not in payload:
+            return HttpResponseBadRequest("Bad struct")
+
+        items_data = payload[self.model_name]
+        if not isinstance(items_data, (list, tuple)):
+            # 全て配列にしておく
+            items_data = [items_data]
+
+        if self.max_items is not None and len(items_data) > self.max_items:
+            return HttpResponse("Too many items", status=413)
+
+        ids = []
+        for item_data in items_data:
+            if not isinstance(item_data, dict) or "id" not in item_data:
+                return HttpResponseBadRequest("Bad struct")
+            try:
+                ids.append(self.id_to_python(item_data["id"]))
+            except (TypeError, ValueError):
+                ids.append(None)
+        valid_ids = [id for id in ids if id is not None]
+        if len(set(valid_ids)) != len(valid_ids):
+            # 同じItemを2回変更しない
+            return HttpResponseBadRequest("Duplicate id")
+
+        # 編集前のオブジェクトをまとめて取得する
+        with self._phase(request, "query"):
+            items = self.get_items_by_ids(request, valid_ids)
+
+        # Formでバリデーションを行う
+        with self._phase(request, "validate"):
+            forms = []
+            error_list = []
+            all_is_valid = True
+            for id, item_data in zip(ids, items_data):
+                item = items.get(id)
+                if item is None:
+                    all_is_valid = False
+                    error_list.append({"id": ["Not Found"]})
+                    continue
+                form = self.get_change_form(request, item, item_data)
+                if request.method == "PATCH":
+                    self._make_partial_form(form, item_data)
+                if not form.is_valid():
+                    all_is_valid = False
+                forms.append(form)
+                error_list.append(self._get_form_errors(form))
+
+        if not all_is_valid:
+            # バリデーションエラーレスポンス
+            response = self.response(error_list, request)
+            response.status_code = 400
+            return response
+
+        with self._phase(request, "save"):
+            items = self.process_update_items(request, forms)
+        if isinstance(items, HttpResponse):
+            return items  # Generate HttpResponse by "process_update_items"
+        self.items_changed()
+
+        with self._phase(request, "serialize"):
+            data = self._items_to_dict(items)
+        return self.response(data, request)
+
 
     def put_item(self, request, id):
+        item_data = self._get_change_data(request)
+        if isinstance(item_data, HttpResponse):
+            return item_data
+
+        # 編集前のオブジェクト
+        with self._phase(request, "query"):
+            item = self.get_item_by_id(request, id)
+        if item is None:
+            raise Http404
 
+        with self._phase(request, "validate"):
+            form = self._get_valid_change_form(request, item, item_data)
+        if isinstance(form, HttpResponse):
+            return form
+
+        with self._phase(request, "save"):
+            item = self.process_update_item(request, form)
+        if isinstance(item, HttpResponse):
+            return item  # Generete HttResponse by "process_update_item"
+        self.items_changed()
+
+        # 生成されたItemを結果として返す
+        with self._phase(request, "serialize"):
+            data = self._items_to_dict(item)
+        return self.response(data, request)
+
+    def _get_change_data(self, request):
+        """リクエストボディから変更する1件のデータを取り出す (エラーの場合はHttpResponse)"""
         if self.change_form is None:
             # フォームが用意されていない場合には追加できない
             return HttpResponseNotAllowed("")
 
         payload = self._get_json_payload(request)
+        if isinstance(payload, HttpResponse):
+            return payload
         if payload is None or self.model_name not in payload:
             return HttpResponseBadRequest("Bad struct")
 
         item_data = payload[self.model_name]
         if isinstance(item_data, (list, tuple)):
             return HttpResponseBadRequest("Cannot Multiple Modify")
+        return item_data
 
-        # 編集前のオブジェクト
-        item = self.get_item_by_id(request, id)
-        if item is None:
-            raise Http404
+    def _make_partial_form(self, form, item_data):
+        """PATCHではデータに含まれないフィールドを変更しない"""
+        for name in list(form.fields):
+            if name not in item_data:
+                del form.fields[name]
+
+    def _get_form_errors(self, form):
+        """フォームのエラーを辞書とリストに変換する
+
+        ErrorDict, ErrorListはorjsonやujsonでは中身のない配列として出力されるため
+        """
+        return OrderedDict((name, [str(error) for error in errors])
+                           for name, errors in form.errors.items())
 
-        # Formによるバリデーション
+    def _get_valid_change_form(self, request, item, item_data):
+        """Formによるバリデーション (エラーの場合はHttpResponse)"""
         form = self.get_change_form(request, item, item_data)
         if not form.is_valid():
             # バリデーションエラーレスポンス
-            response = self.response(form.errors)
+            response = self.response(self._get_form_errors(form), request)
             response.status_code = 400
             return response
-
-        item = self.process_update_item(request, form)
-        if isinstance(item, HttpResponse):
-            return item  # Generete HttResponse by "process_update_item"
-
-        # 生成されたItemを結果として返す
-        return self.response(self._items_to_dict(item))
+        return form
 
     def delete_item(self, request, id):
         # 削除前のオブジェクト
-        item = self.get_item_by_id(request, id)
+        with self._phase(request, "query"):
+            item = self.get_item_by_id(request, id)
         if item is None:
             raise Http404
 
-        response = self.process_delete_item(request, item)
+        with self._phase(request, "save"):
+            response = self.process_delete_item(request, item)
+        self.items_changed()
         if response is None:
             response = HttpResponse(status=202)  # Accepted
         return response
 
+    def delete_index(self, request):
+        """IDのリスト(またはフィルタ)で指定したItemをまとめて削除する"""
+        ids = None
+        if request.body:
+            payload = self._get_json_payload(request)
+            if isinstance(payload, HttpResponse):
+                return payload
+            if payload is None or self.model_name not in payload:
+                return HttpResponseBadRequest("Bad struct")
+
+            ids = payload[self.model_name]
+            if not isinstance(ids, (list, tuple)):
+                ids = [ids]
+            if self.max_items is not None and len(ids) > self.max_items:
+                return HttpResponse("Too many items", status=413)
+            try:
+                ids = [self.id_to_python(id) for id in ids]
+            except (TypeError, ValueError):
+                return HttpResponseBadRequest("Invalid id")
+
+        with self._phase(request, "save"):
+            count = self.process_delete_items(request, ids)
+        if isinstance(count, HttpResponse):
+            return count  # Generate HttpResponse by "process_delete_items"
+        self.items_changed()
+
+        return self.response({"deleted": count}, request)
+
     def _get_json_payload(self, request):
+        if self.max_body_size is not None:
+            # 読み込む前にContent-Lengthで判定する
+            try:
+                length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                length = 0
+            if length > self.max_body_size or len(request.body) > self.max_body_size:
+                return HttpResponse("Request body too large", status=413)
+
         try:
-            payload = json.loads(request.body.decode('utf-8'))
+            payload = get_decoder(self.json_decoder)(request.body)
         except ValueError:
             return None
         return payload
 
 
     """シリアライズ処理"""
-    def _items_to_dict(self, items):
+    def _items_to_dict(self, items, fields=None):
         d = OrderedDict()
         if isinstance(items, (list, tuple, QuerySet)):
-            d[self.model_name] = []
-            for item in items:
-                d[self.model_name].append(self._item_to_dict(item))
+            rows, row_to_dict = self._prepare_items(items, fields)
+            d[self.model_name] = [row_to_dict(row) for row in rows]
         else:
             item = items
-            d[self.model_name] = self._item_to_dict(item)
+            d[self.model_name] = self._item_to_dict(item, self._get_field_plan(fields))
         return d
 
+    def _prepare_items(self, items, fields=None, includes=()):
+        """シリアライズする行と、行を辞書に変換する関数を返す
+
+        行はget_linkedでincludesの関連データを求められるものとする
+        """
+        if fields is None:
+            return items, self._item_to_dict
+        plan = self._get_field_plan(fields)
+        def row_to_dict(item):
+            return self._item_to_dict(item, plan)
+        return items, row_to_dict
+
+    def _fetch_rows(self, items, fields=None, includes=()):
+        """シリアライズする行をリストとして取得し、行を辞書に変換する関数とともに返す"""
+        rows, row_to_dict = self._prepare_items(items, fields, includes)
+        return list(rows), row_to_dict
+
     def _getattr(self, item, name):
         value = item
         # 再帰的に値を参照する
         for f in name.split("__"):
-            try:
-                value = getattr(value, f)
-            except AttributeError:
-                value = value[f]
-
-            if callable(value):
-                # 関数オブジェクトであれば結果を用いる
-                value = value()
+            value = lookup(value, f)
         return value
 
-    def _item_to_dict(self, item):
+    def _get_class_cache(self, name):
+        """クラスごとのキャッシュ (LRUCache) を返す"""
+        cls = type(self)
+        cache = cls.__dict__.get(name)
+        if cache is None:
+            cache = LRUCache(self.class_cache_size)
+            setattr(cls, name, cache)
+        return cache
+
+    def _get_field_plan(self, fields=None):
+        """`fields`をコンパイルした結果を返す (クラスごとに保持する)"""
+        plans = self._get_class_cache("_field_plans")
+        if fields is None:
+            fields = self.fields
+        try:
+            plan = plans.get(fields)
+        except TypeError:
+            # ハッシュできない`fields`は毎回コンパイルする
+            return compile_fields(fields)
+        if plan is None:
+            plan = compile_fields(fields)
+            plans.set(fields, plan)
+        return plan
+
+    def _item_to_dict(self, item, plan=None):
+        if plan is None:
+            plan = self._get_field_plan()
         d = OrderedDict()
-        for field in self.fields:
-            value = item
-            if isinstance(field, (list, tuple)):
-                # ("json_attr_name", "item_attr")
-                field_name = field[0]
-                field = field[1]
-            else:
-                field_name = field
-
-            d[field_name] = self._getattr(value, field)
-
+        for accessor in plan:
+            d[accessor.name] = accessor(item)
         return d
 
-    def response(self, data):
-        if self.metadata and isinstance(data, dict):
-            data["meta"] = self.metadata
-        response = HttpResponse(json.dumps(data, default=self.json_serialize),
-                                content_type=self.content_type)
+    def get_context(self, request):
+        """リクエストごとの状態を保持するAPIContextを返す"""
+        return get_context(self, request)
+
+    def get_metadata(self, request=None):
+        metadata = OrderedDict(self.metadata)
+        if request is not None:
+            context = self.get_context(request)
+            metadata.update(context.pagination)
+            metadata.update(context.meta)
+        return metadata
+
+    def response(self, data, request=None):
+        metadata = self.get_metadata(request)
+        if metadata and isinstance(data, dict):
+            data["meta"] = metadata
+        with self._phase(request, "encode"):
+            content = self.json_dumps(data)
+        response = HttpResponse(content, content_type=self.content_type)
         return response
 
+    def json_dumps(self, data):
+        """JSONのバイト列に変換する"""
+        return get_encoder(self.json_encoder)(data, self.json_serialize)
+
+    def streaming_response(self, items, fields=None, request=None):
+        """一覧を少しずつシリアライズしながら返す"""
+        return StreamingHttpResponse(self._iter_index_json(items, fields, request),
+                                     content_type=self.content_type)
+
+    def _iter_items(self, items):
+        if isinstance(items, QuerySet):
+            # キャッシュせずにチャンク単位で取得する
+            try:
+                return items.iterator(chunk_size=self.stream_chunk_size)
+            except TypeError:
+                return items.iterator()  # Django < 2.0
+        return items
+
+    def _iter_index_json(self, items, fields=None, request=None):
+        yield b'{' + self.json_dumps(self.model_name) + b': ['
+
+        rows, row_to_dict = self._prepare_items(items, fields)
+        chunk = []
+        separator = b""
+        for row in self._iter_items(rows):
+            chunk.append(row)
+            if len(chunk) >= self.stream_chunk_size:
+                yield separator + b", ".join(self._rows_to_json(chunk, row_to_dict, fields, request))
+                separator = b", "
+                chunk = []
+        if chunk:
+            yield separator + b", ".join(self._rows_to_json(chunk, row_to_dict, fields, request))
+
+        # メタデータは全ての行の後に出力する
+        metadata = self.get_metadata(request)
+        if metadata:
+            yield b'], "meta": ' + self.json_dumps(metadata) + b'}'
+        else:
+            yield b']}'
+
+    def _rows_to_json(self, rows, row_to_dict, fields=None, request=None):
+        """行のリストをJSONのバイト列のリストに変換する"""
+        if self.row_cache_timeout is None or self._in_atomic_batch(request):
+            return [self.json_dumps(row_to_dict(row)) for row in rows]
+
+        cache = self._get_cache()
+        if fields is None:
+            fields = self.fields
+        prefix = "%s:%r:" % (self.get_cache_prefix(), fields)
+        if self.row_version_field is None:
+            prefix += "%s:" % self._get_cache_version(cache)
+
+        keys = []
+        for row in rows:
+            key = prefix + repr(self._getattr(row, "id"))
+            if self.row_version_field is not None:
+                key += ":%r" % (self._getattr(row, self.row_version_field),)
+            keys.append("jsonapi:row:%s" % hashlib.md5(key.encode("utf-8")).hexdigest())
+
+        # まとめて取得し、なかった行だけをシリアライズする
+        cached = cache.get_many(keys)
+        fragments = []
+        missing = {}
+        for key, row in zip(keys, rows):
+            fragment = cached.get(key)
+            if fragment is None:
+                fragment = missing[key] = self.json_dumps(row_to_dict(row))
+            fragments.append(fragment)
+        if missing:
+            cache.set_many(missing, self.row_cache_timeout)
+        return fragments
+
     def json_serialize(self, obj):
         """JSONに変換できないオブジェクトを変換"""
         if hasattr(obj, "isoformat"):
             return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return str(obj)
         raise ValueError
 
     """データ更新関係"""
@@ -239,20 +872,98 @@ class JSONAPI(object):
         item = form.cleaned_data
         return item
 
+    def process_update_items(self, request, forms):
+        items = []
+        for form in forms:
+            item = self.process_update_item(request, form)
+            if isinstance(item, HttpResponse):
+                return item
+            items.append(item)
+        return items
+
     def process_delete_item(self, request, item):
         return None
 
+    def process_delete_items(self, request, ids):
+        """まとめて削除し、削除した件数を返す"""
+        if ids is None:
+            return HttpResponseBadRequest("No ids")
+        items = self.get_items_by_ids(request, ids)
+        for item in items.values():
+            response = self.process_delete_item(request, item)
+            if isinstance(response, HttpResponse):
+                return response
+        return len(items)
+
     """データの取得関係"""
     def id_to_python(self, id_str):
         return int(id_str)
 
+    def get_id_converter(self):
+        """URLのidに用いるpath()のコンバーター ("int", "uuid", "str" など)"""
+        if getattr(self.id_to_python, "__func__", None) is JSONAPI.id_to_python:
+            return "int"
+        return "str"
+
     def get_items_for_request(self, request):
         """すべてのデータを返すメソッド"""
         raise NotImplementedError
 
+    def get_items_version(self, request):
+        """データのバージョンを返すメソッド (データが変更されたら異なる値を返すこと)"""
+        return None
+
+    def items_changed(self):
+        """データが変更されたことを通知するメソッド"""
+        self._id_index = None
+        if self.cache_timeout is not None or self.row_cache_timeout is not None:
+            # キャッシュしたレスポンスと行を無効にする
+            # (トランザクション内ではコミット後に行い、ロールバックした変更をキャッシュさせない)
+            on_commit = getattr(transaction, "on_commit", None)
+            if on_commit is None:
+                self._bump_cache_version()  # Django < 1.9
+            else:
+                on_commit(self._bump_cache_version, using=self._get_write_db())
+
+    def _bump_cache_version(self):
+        self._get_cache().set(self._get_cache_version_key(), int(time.time() * 1000000), None)
+
+    def _get_write_db(self):
+        """データを書き込むデータベースのエイリアスを返す (Noneの場合はdefault)"""
+        return None
+
+    def _get_id_index(self, request):
+        """idからデータを引く辞書を返す (データかバージョンが変わったら作り直す)"""
+        items = self.get_items_for_request(request)
+        version = self.get_items_version(request)
+        size = len(items) if hasattr(items, "__len__") else None
+
+        index = self._id_index
+        if index is None or index[0] is not items or index[1] != version or index[2] != size:
+            mapping = {}
+            for item in items:
+                mapping.setdefault(self._getattr(item, "id"), item)
+            index = (items, version, size, mapping)
+            self._id_index = index
+        return index[3]
+
+    def get_items_by_ids(self, request, ids):
+        """IDのリストから{ID: データ}の辞書を返すメソッド (存在しないIDは含まない)"""
+        items = {}
+        for id in ids:
+            try:
+                item = self.get_item_by_id(request, id)
+            except Http404:
+                item = None
+            if item is not None:
+                items[id] = item
+        return items
+
     def get_item_by_id(self, request, id):
         """IDで特定のデータを返すメソッド"""
         id = self.id_to_python(id)
+        if self.id_index:
+            return self._get_id_index(request).get(id)
         for item in self.get_items_for_request(request):
             if self._getattr(item, "id") == id:
                 return item
@@ -0,0 +1,103 @@
+# encoding=utf-8
+from operator import attrgetter, itemgetter
+
+from django.db.models.manager import Manager
+
+
+# 参照に失敗したときに送出されうる例外
+LOOKUP_ERRORS = (AttributeError, KeyError, IndexError, TypeError)
+
+
+def evaluate(value):
+    """参照した値が関数であれば結果を、関連オブジェクトのマネージャであればQuerySetを返す"""
+    if isinstance(value, Manager):
+        # prefetch_relatedのキャッシュを用いるためall()で取得する
+        return value.all()
+    if callable(value):
+        return value()
+    return value
+
+
+def has_attribute(value, name):
+    """値を評価せずに属性が定義されているか判定する (プロパティやスロットを含む)"""
+    return hasattr(type(value), name) or name in getattr(value, "__dict__", ())
+
+
+def get_value(value, name):
+    """属性を参照し、存在しなければ添字で参照する
+
+    定義されている属性(プロパティなど)の評価で発生したAttributeErrorはそのまま送出する
+    """
+    try:
+        return getattr(value, name)
+    except AttributeError:
+        if has_attribute(value, name):
+            raise
+    return value[name]
+
+
+def lookup(value, name):
+    """属性を参照し、存在しなければ添字で参照する"""
+    return evaluate(get_value(value, name))
+
+
+class FieldAccessor(object):
+    """`fields`の1要素から値を取り出すオブジェクト
+
+    属性参照(attrgetter)か添字参照(itemgetter)かは最初の値で決定し、
+    以降はその参照方法を用いる。
+    """
+
+    __slots__ = ("name", "path", "_getters")
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = tuple(path.split("__"))
+        self._getters = None
+
+    def _resolve(self, item):
+        """参照方法を決定しながら値を取り出す"""
+        getters = []
+        value = item
+        for attr in self.path:
+            try:
+                value = getattr(value, attr)
+                getters.append((attr, attrgetter(attr), True))
+            except AttributeError:
+                if has_attribute(value, attr):
+                    raise
+                value = value[attr]
+                getters.append((attr, itemgetter(attr), False))
+            value = evaluate(value)
+        self._getters = tuple(getters)
+        return value
+
+    def __call__(self, item):
+        getters = self._getters
+        if getters is None:
+            return self._resolve(item)
+
+        value = item
+        for attr, getter, is_attribute in getters:
+            try:
+                value = getter(value)
+            except LOOKUP_ERRORS:
+                if is_attribute and has_attribute(value, attr):
+                    # 属性の評価で発生した例外 (参照し直すと2回評価してしまう)
+                    raise
+                # 型の異なるitemが混在している場合は通常の参照を行う
+                value = get_value(value, attr)
+            value = evaluate(value)
+        return value
+
+
+def compile_fields(fields):
+    """`fields`をFieldAccessorのタプルに変換する"""
+    plan = []
+    for field in fields:
+        if isinstance(field, (list, tuple)):
+            # ("json_attr_name", "item_attr")
+            plan.append(FieldAccessor(field[0], field[1]))
+        else:
+            plan.append(FieldAccessor(field, field))
+    return tuple(plan)
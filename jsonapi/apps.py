@@ -0,0 +1,12 @@
+# encoding=utf-8
+from django.apps import AppConfig
+from django.core import checks
+
+
+class JSONAPIConfig(AppConfig):
+    name = "jsonapi"
+    verbose_name = "JSON API"
+
+    def ready(self):
+        from jsonapi.indexes import check_indexes
+        checks.register("jsonapi")(check_indexes)
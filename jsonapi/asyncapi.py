@@ -0,0 +1,347 @@
+# encoding=utf-8
+from collections import OrderedDict
+from inspect import isgeneratorfunction
+from itertools import islice
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.db.models.query import QuerySet
+from django.http.response import HttpResponseNotAllowed, HttpResponse, Http404, \
+    StreamingHttpResponse
+
+from jsonapi.instrumentation import QueryCounter
+from jsonapi.models import ModelJSONAPI
+
+
+class AsyncModelJSONAPI(ModelJSONAPI):
+    """Djangoの非同期ORMを用いるModelJSONAPI (Django >= 4.2, ASGI)
+
+    一覧と1件の取得・追加・変更・削除は非同期のQuerySetのメソッドで処理する。
+    トランザクションを必要とする一覧への一括変更・一括削除とbulk_addは同期版をスレッドで実行する。
+    """
+
+    def wrap_view(self, view_func):
+        async def view(request, *args, **kwargs):
+            return await view_func(request, *args, **kwargs)
+        view.csrf_exempt = True
+        return view
+
+    """リクエストの処理関係"""
+
+    async def request_index(self, request):
+        return await self._ainstrument(request, self._adispatch_index)
+
+    async def request_item(self, request, id):
+        return await self._ainstrument(request, self._adispatch_item, id)
+
+    async def _ainstrument(self, request, view, *args):
+        budget = self.get_query_budget(request, *args)
+        if budget is None and not self._is_instrumented():
+            return await view(request, *args)
+
+        # クエリはsync_to_asyncのスレッドで実行されるため、そのスレッドの接続で数える
+        start = perf_counter()
+        queries = QueryCounter()
+        await sync_to_async(queries.__enter__)()
+        try:
+            response = await view(request, *args)
+        finally:
+            await sync_to_async(queries.__exit__)(None, None, None)
+        if response.streaming:
+            response.streaming_content = self._aiter_counting_queries(
+                request, response, response.streaming_content, queries, budget, start)
+            return response
+        self._queries_finished(request, response, queries, budget, start)
+        return response
+
+    async def _aiter_counting_queries(self, request, response, content, queries, budget, start):
+        size = 0
+        while True:
+            await sync_to_async(queries.__enter__)()
+            try:
+                chunk = await content.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                await sync_to_async(queries.__exit__)(None, None, None)
+            if budget is not None and queries.count > budget and self.query_budget_action == "raise":
+                self._query_budget_exceeded(request, queries.count, budget)
+            size += len(chunk)
+            yield chunk
+        self._set_stat(request, "bytes", size)
+        self._queries_finished(request, response, queries, budget, start)
+
+    async def _adispatch_index(self, request):
+        if request.method == "GET":
+            return await self._acached_response(request, self.aget_index)
+        if request.method == "POST":
+            return await self.apost_index(request)
+        if request.method in ("PUT", "PATCH") and self.allow_bulk_change:
+            return await sync_to_async(self.put_index)(request)
+        if request.method == "DELETE" and self.allow_bulk_delete:
+            return await sync_to_async(self.delete_index)(request)
+        return HttpResponseNotAllowed("")
+
+    async def _adispatch_item(self, request, id):
+        if request.method == "GET":
+            return await self._acached_response(request, self.aget_item, id)
+        if request.method == "PUT":
+            return await self.aput_item(request, id)
+        if request.method == "DELETE":
+            return await self.adelete_item(request, id)
+        return HttpResponseNotAllowed("")
+
+    async def _acached_response(self, request, view, *args):
+        state = await sync_to_async(self._get_cache_state)(request, *args)
+        if state is None:
+            return await view(request, *args)
+
+        response = await sync_to_async(self._get_cached_response)(request, state)
+        if response is None:
+            response = await view(request, *args)
+            if response.status_code != 200:
+                return response
+            await sync_to_async(self._store_response)(state, response)
+        return self._set_cache_headers(state, response)
+
+    # 取得系
+    async def aget_index(self, request):
+        fields = self.get_fields(request)
+        if isinstance(fields, HttpResponse):
+            return fields
+        includes = self.get_includes(request)
+        if isinstance(includes, HttpResponse):
+            return includes
+        with self._phase(request, "query"):
+            items = await self.aget_items_for_request(request)
+        if isinstance(items, HttpResponse):
+            return items
+        if self.streaming and not includes:
+            return StreamingHttpResponse(self._aiter_index_json(items, fields, request),
+                                         content_type=self.content_type)
+        if self.row_cache_timeout is not None and not includes and not self._in_atomic_batch(request):
+            with self._phase(request, "serialize"):
+                content = [chunk async for chunk in self._aiter_index_json(items, fields, request)]
+            return HttpResponse(b"".join(content), content_type=self.content_type)
+
+        with self._phase(request, "query"):
+            rows, row_to_dict = await self._afetch_rows(items, fields, includes)
+        with self._phase(request, "serialize"):
+            data = OrderedDict()
+            data[self.model_name] = await self._arows_to_list(rows, row_to_dict,
+                                                              self._serialize_in_thread(items, fields))
+            if includes:
+                data["linked"] = await sync_to_async(self.get_linked)(request, rows, includes)
+        self._set_stat(request, "rows", len(data[self.model_name]))
+        return self.response(data, request)
+
+    async def aget_item(self, request, id):
+        fields = self.get_fields(request)
+        if isinstance(fields, HttpResponse):
+            return fields
+        includes = self.get_includes(request)
+        if isinstance(includes, HttpResponse):
+            return includes
+        with self._phase(request, "query"):
+            item = await self.aget_item_by_id(request, id)
+        if item is None:
+            raise Http404()
+        with self._phase(request, "serialize"):
+            data = await self._aitems_to_dict(item, fields)
+            if includes:
+                data["linked"] = await sync_to_async(self.get_linked)(request, item, includes)
+        return self.response(data, request)
+
+    # ADD
+    async def apost_index(self, request):
+        # ModelFormのバリデーションはユニーク制約の確認でクエリを実行する
+        with self._phase(request, "validate"):
+            forms = await sync_to_async(self._get_add_forms)(request)
+        if isinstance(forms, HttpResponse):
+            return forms
+
+        with self._phase(request, "save"):
+            items = await self.aprocess_add_items(request, forms)
+        if isinstance(items, HttpResponse):
+            return items  # Generate HttpResponse by "aprocess_add_items"
+        await sync_to_async(self.items_changed)()
+
+        return self.response(await self._aitems_to_dict(items), request)
+
+    async def aput_item(self, request, id):
+        item_data = self._get_change_data(request)
+        if isinstance(item_data, HttpResponse):
+            return item_data
+
+        with self._phase(request, "query"):
+            item = await self.aget_item_by_id(request, id)
+        if item is None:
+            raise Http404
+
+        with self._phase(request, "validate"):
+            form = await sync_to_async(self._get_valid_change_form)(request, item, item_data)
+        if isinstance(form, HttpResponse):
+            return form
+
+        with self._phase(request, "save"):
+            item = await self.aprocess_update_item(request, form)
+        if isinstance(item, HttpResponse):
+            return item  # Generate HttpResponse by "aprocess_update_item"
+        await sync_to_async(self.items_changed)()
+
+        return self.response(await self._aitems_to_dict(item), request)
+
+    async def adelete_item(self, request, id):
+        item = await self.aget_item_by_id(request, id)
+        if item is None:
+            raise Http404
+
+        with self._phase(request, "save"):
+            response = await self.aprocess_delete_item(request, item)
+        await sync_to_async(self.items_changed)()
+        if response is None:
+            response = HttpResponse(status=202)  # Accepted
+        return response
+
+    """シリアライズ関係"""
+    def _serialize_in_thread(self, items, fields=None):
+        """シリアライズでクエリが実行されうるか (values_listのタプル以外はモデルのインスタンス)"""
+        return not self._uses_value_columns(items, fields)
+
+    async def _aiter_chunks(self, rows):
+        """stream_chunk_size件ずつのリストを返す非同期イテレータ"""
+        size = self.stream_chunk_size
+        if not isinstance(rows, QuerySet):
+            iterator = iter(rows)
+            chunk = _next_chunk(iterator, size)
+            while chunk:
+                yield chunk
+                chunk = _next_chunk(iterator, size)
+            return
+
+        if not isgeneratorfunction(rows._iterable_class.__iter__):
+            # values_list()のイテラブルは__iter__()の呼び出しでクエリを実行するため、
+            # aiterator()ではイベントループ内でクエリを実行してしまう (SynchronousOnlyOperation)
+            iterator = iter(self._iter_items(rows))
+            while True:
+                chunk = await sync_to_async(_next_chunk)(iterator, size)
+                if chunk:
+                    yield chunk
+                if len(chunk) < size:
+                    break
+            return
+
+        # aiterator()はchunk_size件ずつスレッドでクエリの結果を取得する
+        chunk = []
+        async for row in rows.aiterator(chunk_size=size):
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _afetch_rows(self, items, fields=None, includes=()):
+        rows, row_to_dict = self._prepare_items(items, fields, includes)
+        if isinstance(rows, QuerySet):
+            rows = [row async for row in rows]
+        return rows, row_to_dict
+
+    async def _arows_to_list(self, rows, row_to_dict, in_thread=True):
+        if in_thread:
+            return await sync_to_async(_rows_to_list)(rows, row_to_dict)
+        return _rows_to_list(rows, row_to_dict)
+
+    async def _aitems_to_dict(self, items, fields=None):
+        # モデルのインスタンスは関連するオブジェクトの取得でクエリを実行しうる
+        return await sync_to_async(self._items_to_dict)(items, fields)
+
+    async def _arows_to_json(self, rows, row_to_dict, fields, request=None, in_thread=True):
+        if in_thread:
+            return await sync_to_async(self._rows_to_json)(rows, row_to_dict, fields, request)
+        return self._rows_to_json(rows, row_to_dict, fields, request)
+
+    async def _aiter_index_json(self, items, fields=None, request=None):
+        yield b'{' + self.json_dumps(self.model_name) + b': ['
+
+        rows, row_to_dict = self._prepare_items(items, fields)
+        # 行のキャッシュを使う場合はvalues_listを使わないため、キャッシュの読み書きもスレッドで行う
+        in_thread = self._serialize_in_thread(items, fields)
+        separator = b""
+        async for chunk in self._aiter_chunks(rows):
+            yield separator + b", ".join(await self._arows_to_json(chunk, row_to_dict, fields, request, in_thread))
+            separator = b", "
+
+        metadata = self.get_metadata(request)
+        if metadata:
+            yield b'], "meta": ' + self.json_dumps(metadata) + b'}'
+        else:
+            yield b']}'
+
+    """データ取得処理関係"""
+    async def aget_items_for_request(self, request):
+        filter_dict = self._get_filter_dict(request)
+        if isinstance(filter_dict, HttpResponse):
+            return filter_dict
+        queryset, order_by_list = self._get_sorted_queryset(request, filter_dict)
+
+        per_page, page = self._get_page_params(request)
+        if per_page > 0:
+            if self._use_cursor(request):
+                keyset, state = self._get_cursor_keyset(request, queryset, order_by_list, per_page)
+                rows = [row async for row in keyset]
+                queryset = self._page_by_cursor(request, queryset, per_page, rows, state)
+            else:
+                queryset = await self._apaginate_by_page(request, queryset, per_page, page)
+        return queryset
+
+    async def _apaginate_by_page(self, request, queryset, per_page, page):
+        queryset = self._get_page_queryset(queryset)
+        if self.count_mode == "none":
+            pks = [pk async for pk in self._get_page_pks(queryset, per_page, page)]
+            return self._page_by_pks(request, queryset, per_page, page, pks)
+        if self.count_mode == "exact":
+            total = await queryset.acount()
+        else:
+            # キャッシュや統計情報を参照する
+            total = await sync_to_async(self._count_items)(queryset)
+        return self._page_by_total(request, queryset, per_page, page, total)
+
+    async def aget_item_by_id(self, request, id):
+        queryset = self._apply_related_lookups(self.get_queryset(request))
+        try:
+            return await queryset.aget(id=id)
+        except self.model.DoesNotExist:
+            raise Http404()
+
+    """データ更新関係"""
+    async def _asave_form(self, form):
+        item = form.save(commit=False)
+        await item.asave()
+        if self.model._meta.many_to_many:
+            await sync_to_async(form.save_m2m)()
+        return item
+
+    async def aprocess_add_items(self, request, forms):
+        if self.bulk_add:
+            # transaction.atomicは同期処理でのみ用いることができる
+            return await sync_to_async(self.process_add_items)(request, forms)
+        items = []
+        for form in forms:
+            items.append(await self._asave_form(form))
+        return items
+
+    async def aprocess_update_item(self, request, form):
+        return await self._asave_form(form)
+
+    async def aprocess_delete_item(self, request, item):
+        await item.adelete()
+        return None
+
+
+def _next_chunk(iterator, size):
+    return list(islice(iterator, size))
+
+
+def _rows_to_list(rows, row_to_dict):
+    return [row_to_dict(row) for row in rows]
@@ -0,0 +1,33 @@
+# encoding=utf-8
+from collections import OrderedDict
+
+
+class APIContext(object):
+    """1つのリクエストを処理する間の状態
+
+    APIのインスタンスは全てのリクエスト(スレッド)で共有されるため、
+    リクエストごとに変わる値はインスタンスではなくこのオブジェクトに保持する。
+    """
+
+    def __init__(self, api, request):
+        self.api = api
+        self.request = request
+        # レスポンスのmetaに追加する値
+        self.meta = OrderedDict()
+        # ページネーションの情報 (total, per_page, page, next, prev など)
+        self.pagination = OrderedDict()
+        # 処理ごとにかかった秒数
+        self.timings = OrderedDict()
+        # 行数、バイト数、クエリ数など
+        self.stats = OrderedDict()
+
+
+def get_context(api, request):
+    """リクエストに対するAPIのコンテキストを返す (なければ生成する)"""
+    contexts = getattr(request, "_jsonapi_contexts", None)
+    if contexts is None:
+        contexts = request._jsonapi_contexts = {}
+    context = contexts.get(api)
+    if context is None:
+        context = contexts[api] = APIContext(api, request)
+    return context
@@ -0,0 +1,91 @@
+# encoding=utf-8
+from decimal import Decimal
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def json_dumps(data, default):
+    return json.dumps(data, default=default).encode("utf-8")
+
+
+def orjson_dumps(data, default):
+    # 日時もdefault(json_serialize)で変換する
+    return orjson.dumps(data, default=default,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def _replace_decimals(data, default):
+    """Decimalをdefaultで変換した値に置き換える"""
+    if isinstance(data, Decimal):
+        return default(data)
+    if isinstance(data, dict):
+        return dict((key, _replace_decimals(value, default)) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return [_replace_decimals(value, default) for value in data]
+    return data
+
+
+def ujson_dumps(data, default):
+    # ujsonはDecimalをdefaultに渡さず数値として出力するため、先に変換する
+    return ujson.dumps(_replace_decimals(data, default), default=default, ensure_ascii=False,
+                       escape_forward_slashes=False).encode("utf-8")
+
+
+ENCODERS = {
+    "json": json_dumps,
+    "orjson": orjson_dumps if orjson is not None else None,
+    "ujson": ujson_dumps if ujson is not None else None,
+}
+
+
+def json_loads(content):
+    try:
+        return json.loads(content)
+    except TypeError:
+        # Python < 3.6 はバイト列を受け付けない
+        return json.loads(content.decode("utf-8"))
+
+
+DECODERS = {
+    "json": json_loads,
+    "orjson": orjson.loads if orjson is not None else None,
+    "ujson": ujson.loads if ujson is not None else None,
+}
+
+
+def _get_backend(backends, name):
+    if name == "auto":
+        for name in ("orjson", "ujson", "json"):
+            if backends[name] is not None:
+                return backends[name]
+    backend = backends.get(name)
+    if backend is None:
+        raise ImproperlyConfigured("JSON backend '%s' is not available." % name)
+    return backend
+
+
+def get_encoder(name="auto"):
+    """`dumps(data, default)`形式でバイト列を返す関数を返す
+
+    "auto"の場合はorjson, ujson, jsonの順に利用できるものを用いる
+    """
+    return _get_backend(ENCODERS, name)
+
+
+def get_decoder(name="auto"):
+    """バイト列を受け取る`loads(content)`形式の関数を返す
+
+    不正なJSONの場合はValueError(またはそのサブクラス)を送出する
+    """
+    return _get_backend(DECODERS, name)
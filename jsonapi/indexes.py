@@ -0,0 +1,161 @@
+# encoding=utf-8
+from collections import OrderedDict
+from importlib import import_module
+
+from django.conf import settings
+from django.db import models
+
+from jsonapi.models import get_registered_apis
+from jsonapi.paths import resolve_path, COLUMN, SINGLE
+
+
+# B-treeの索引を用いることができないルックアップ
+UNINDEXED_LOOKUPS = ("contains", "icontains", "endswith", "iendswith", "iexact", "istartswith",
+                     "regex", "iregex", "search", "month", "day", "week_day", "hour", "minute",
+                     "second")
+
+
+def resolve_column(model, path):
+    """フィルタやソートのパスを(カラムを持つモデル, フィールド, 関係をたどったか)に解決する
+
+    カラムでない場合や索引を用いることができない場合はNoneを返す
+    """
+    steps, rest = resolve_path(model, path)
+    if not steps or len(rest) > 1 or (rest and rest[0] in UNINDEXED_LOOKUPS):
+        return None
+    name, kind, field = steps[-1]
+    if kind != COLUMN and not (kind == SINGLE and getattr(field, "attname", None)):
+        # 逆参照や多対多の関係は相手のテーブルの外部キーを用いる
+        return None
+    return field.model, field, len(steps) > 1
+
+
+def _get_field_name(model, name):
+    name = name.lstrip("-")
+    if name == "pk":
+        return model._meta.pk.name
+    return name
+
+
+def get_model_indexes(model):
+    """モデルに定義されている索引をフィールド名のタプルのリストで返す"""
+    opts = model._meta
+    indexes = []
+    for field in opts.local_fields:
+        if field.primary_key or field.unique or field.db_index:
+            indexes.append((field.name,))
+    indexes.extend(opts.unique_together)
+    indexes.extend(getattr(opts, "index_together", ()))  # Django < 5.1
+    for index in getattr(opts, "indexes", ()):  # Django >= 1.11
+        if index.fields:
+            indexes.append(index.fields)
+    for constraint in getattr(opts, "constraints", ()):  # Django >= 2.2
+        if getattr(constraint, "fields", None) and getattr(constraint, "condition", None) is None:
+            indexes.append(constraint.fields)
+    return [tuple(_get_field_name(model, name) for name in index) for index in indexes]
+
+
+def is_covered(fields, indexes):
+    """fieldsを先頭に持つ索引があるか"""
+    return any(index[:len(fields)] == fields for index in indexes)
+
+
+def get_required_indexes(api):
+    """APIのfiltersとorder_fieldsが用いる索引を[(モデル, フィールド名のタプル, 理由), ...]で返す"""
+    required = []
+    name = type(api).__name__
+    for attr, (path, coerce) in sorted(api._filter_table.items()):
+        column = resolve_column(api.model, path)
+        if column is not None:
+            model, field, related = column
+            required.append((model, (field.name,), "%s filter %s" % (name, attr)))
+
+    for attr, path in sorted(api._order_table.items()):
+        if attr.startswith(("+", "-")):
+            continue
+        column = resolve_column(api.model, path)
+        if column is None:
+            continue
+        model, field, related = column
+        pk_name = model._meta.pk.name
+        if related or field.name == pk_name:
+            fields = (field.name,)
+        else:
+            # カーソルによるページネーションは(ソート順, id)で次のページを探す
+            fields = (field.name, pk_name)
+        required.append((model, fields, "%s sort %s" % (name, attr)))
+    return required
+
+
+def get_index_suggestions(apis=None):
+    """定義されていない索引を[(モデル, フィールド名のタプル, 理由のリスト), ...]で返す
+
+    apisを指定しない場合は生成された全てのModelJSONAPIを対象とする
+    """
+    if apis is None:
+        apis = get_registered_apis()
+
+    missing = OrderedDict()
+    model_indexes = {}
+    for api in apis:
+        for model, fields, reason in get_required_indexes(api):
+            if model not in model_indexes:
+                model_indexes[model] = get_model_indexes(model)
+            if is_covered(fields, model_indexes[model]):
+                continue
+            reasons = missing.setdefault((model, fields), [])
+            if reason not in reasons:
+                reasons.append(reason)
+
+    # 他の提案の先頭と一致する索引はその提案にまとめる
+    suggestions = OrderedDict()
+    for (model, fields), reasons in missing.items():
+        longer = [other for m, other in missing
+                  if m is model and len(other) > len(fields) and other[:len(fields)] == fields]
+        if longer:
+            fields = max(longer, key=len)
+        merged = suggestions.setdefault((model, fields), [])
+        merged.extend(reason for reason in reasons if reason not in merged)
+    return [(model, fields, reasons) for (model, fields), reasons in suggestions.items()]
+
+
+def format_index(fields):
+    """Meta.indexes (Django < 1.11はindex_together) に追加する値"""
+    names = ", ".join('"%s"' % name for name in fields)
+    if hasattr(models, "Index"):
+        return "models.Index(fields=[%s])" % names
+    return "(%s,)" % names if len(fields) == 1 else "(%s)" % names
+
+
+def get_indexes_option():
+    return "indexes" if hasattr(models, "Index") else "index_together"
+
+
+def load_urlconf():
+    """URLconfを読み込んでAPIを生成させる"""
+    urlconf = getattr(settings, "ROOT_URLCONF", None)
+    if urlconf:
+        import_module(urlconf)
+
+
+def check_indexes(app_configs=None, **kwargs):
+    """システムチェック (jsonapi.W001)
+
+    生成済みのModelJSONAPIを対象とする。URLconfはDjangoのURLのチェックで読み込まれるため、
+    ここでは読み込まない (`--tag jsonapi`のみの場合はmanage.py jsonapi_indexesを用いる)
+    """
+    from django.core import checks
+
+    errors = []
+    for model, fields, reasons in get_index_suggestions():
+        if app_configs is not None and model._meta.app_config not in app_configs:
+            continue
+        errors.append(checks.Warning(
+            "%s.%s has no index for (%s)." % (model._meta.app_label, model._meta.object_name,
+                                              ", ".join(fields)),
+            hint="Add %s to Meta.%s. Used by %s." % (format_index(fields), get_indexes_option(),
+                                                     ", ".join(reasons)),
+            obj=model,
+            id="jsonapi.W001",
+        ))
+    return errors
@@ -0,0 +1,128 @@
+# encoding=utf-8
+import logging
+from time import perf_counter
+
+from django.db import connections
+
+
+logger = logging.getLogger("jsonapi")
+
+
+class QueryBudgetExceeded(Exception):
+    """クエリ数が`max_queries_*`を超えた (query_budget_action = "raise")"""
+    pass
+
+
+class Observer(object):
+    """リクエストの計測結果を受け取るオブジェクト
+
+    JSONAPIの`observers`に登録すると、リクエストごとに`request_finished`が呼ばれる
+    """
+
+    def request_finished(self, api, request, context, response):
+        """`context.timings`に処理ごとの秒数、`context.stats`に件数などが入っている"""
+        pass
+
+
+class LoggingObserver(Observer):
+    """計測結果をloggingに出力する"""
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def request_finished(self, api, request, context, response):
+        self.logger.log(self.level, "%s %s %s %s", request.method, request.path,
+                        format_timings(context.timings), format_stats(context.stats))
+
+
+class PhaseTimer(object):
+    """withブロックの実行時間を`timings[name]`に加算する"""
+
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + perf_counter() - self.start
+        return False
+
+
+class NullTimer(object):
+    """計測しない場合に用いる何もしないタイマー"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class QueryCounter(object):
+    """withブロックで実行されたクエリの数と秒数を数える (全てのデータベース)"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._contexts = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += perf_counter() - start
+
+    def __enter__(self):
+        for connection in connections.all():
+            if hasattr(connection, "execute_wrapper"):
+                context = connection.execute_wrapper(self)
+            else:
+                # Django < 2.0 はデバッグ用のカーソルで記録する
+                from django.test.utils import CaptureQueriesContext
+                context = CaptureQueriesContext(connection)
+            context.__enter__()
+            self._contexts.append(context)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._contexts:
+            context = self._contexts.pop()
+            context.__exit__(*exc_info)
+            if hasattr(context, "captured_queries"):
+                for query in context.captured_queries:
+                    self.count += 1
+                    self.time += float(query["time"])
+        return False
+
+
+def format_timings(timings):
+    return " ".join("%s=%.3fms" % (name, seconds * 1000) for name, seconds in timings.items())
+
+
+def format_stats(stats):
+    return " ".join("%s=%s" % (name, value) for name, value in stats.items())
+
+
+def format_server_timing(context):
+    """`Server-Timing`ヘッダの値を返す"""
+    metrics = []
+    for name, seconds in context.timings.items():
+        metric = "%s;dur=%.3f" % (name, seconds * 1000)
+        if name == "db" and "queries" in context.stats:
+            metric += ';desc="%d queries"' % context.stats["queries"]
+        metrics.append(metric)
+    return ", ".join(metrics)
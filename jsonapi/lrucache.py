@@ -0,0 +1,35 @@
+# encoding=utf-8
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """最大件数を超えると最も長く参照されていない要素を捨てる辞書"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        # 最後に参照された要素として末尾に移す
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            try:
+                self._data.popitem(last=False)
+            except KeyError:
+                # 他のスレッドが先に捨てた
+                break
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
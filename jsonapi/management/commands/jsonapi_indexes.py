@@ -0,0 +1,42 @@
+# encoding=utf-8
+from optparse import make_option
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from jsonapi.indexes import get_index_suggestions, format_index, get_indexes_option, load_urlconf
+
+
+class Command(BaseCommand):
+    help = ("Report database indexes that the filters and order_fields of every "
+            "ModelJSONAPI need but the models do not define.")
+
+    if django.VERSION < (1, 8):
+        option_list = BaseCommand.option_list + (
+            make_option("--fail", action="store_true", default=False,
+                        help="Exit with an error if any index is missing"),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fail", action="store_true", default=False,
+                            help="Exit with an error if any index is missing")
+
+    def handle(self, *args, **options):
+        # URLconfで生成されるAPIを登録する
+        load_urlconf()
+        suggestions = get_index_suggestions()
+        if not suggestions:
+            self.stdout.write("No missing indexes.")
+            return
+
+        option = get_indexes_option()
+        current = None
+        for model, fields, reasons in suggestions:
+            if model is not current:
+                current = model
+                self.stdout.write("%s.%s: Meta.%s" % (model._meta.app_label,
+                                                      model._meta.object_name, option))
+            self.stdout.write("    %s,  # %s" % (format_index(fields), ", ".join(reasons)))
+
+        if options["fail"]:
+            raise CommandError("%d missing indexes" % len(suggestions))
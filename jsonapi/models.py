@@ -1,10 +1,132 @@
 # encoding=utf-8
-import re
+import base64
+import json
+import hashlib
+import weakref
+from collections import OrderedDict
+import django
 from jsonapi import JSONAPI
+from jsonapi.paths import classify_field, resolve_path, COLUMN, SINGLE, MULTI
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.http.response import HttpResponse, HttpResponseBadRequest
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:  # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
 from django.shortcuts import get_object_or_404
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.deletion import Collector
+from django.db.models.signals import pre_save, post_save
 from django.db.models.base import Model
-from django.core.paginator import Paginator
+from django.db.models.query import QuerySet
+
+
+# モデルごとにregister_apiで登録したModelJSONAPI
+_registry = {}
+# 生成された全てのModelJSONAPI
+_apis = weakref.WeakSet()
+
+
+def register_api(api):
+    """includesで参照先のデータを出力するモデルのAPIとして登録し、そのまま返す
+
+    1つのモデルに登録できるAPIは1つだけ
+    """
+    registered = _registry.setdefault(api.model, api)
+    if registered is not api:
+        raise ImproperlyConfigured("An API is already registered for %s." % api.model.__name__)
+    return api
+
+
+def get_registered_apis():
+    """生成された全てのModelJSONAPIをモデルとクラスの名前の順に返す"""
+    return sorted(_apis, key=lambda api: (api.model._meta.app_label,
+                                          api.model._meta.object_name, type(api).__name__))
+
+
+def get_api_for_model(model):
+    """登録されたモデルのAPIを返す (登録されていない場合はNone)"""
+    return _registry.get(model)
+
+
+# 値を変換せずに渡すルックアップ
+TEXT_LOOKUPS = ("contains", "icontains", "startswith", "istartswith", "endswith", "iendswith",
+                "iexact", "regex", "iregex", "search")
+# 日時の一部を整数で比較するルックアップ
+PART_LOOKUPS = ("year", "month", "day", "week_day", "hour", "minute", "second")
+
+TRUE_VALUES = ("1", "t", "true", "y", "yes", "on")
+FALSE_VALUES = ("0", "f", "false", "n", "no", "off")
+
+
+def parse_bool(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError("Invalid boolean: %s" % value)
+
+
+def _split_values(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _get_function(cls, name):
+    """オーバーライドされたか比較するためのメソッドの関数を返す"""
+    method = getattr(cls, name)
+    return getattr(method, "__func__", method)  # Python 2 の非束縛メソッド
+
+
+def _get_target_field(kind, field):
+    """パスの末尾のフィールドが比較する値のフィールド (外部キーは参照先の主キー)"""
+    if kind == COLUMN:
+        return field
+    target = getattr(field, "target_field", None)
+    if target is None and hasattr(field, "rel") and hasattr(field.rel, "get_related_field"):
+        target = field.rel.get_related_field()  # Django < 1.9
+    if target is None:
+        target = classify_field(field)[1]._meta.pk  # 逆参照
+    return target
+
+
+def get_filter_coerce(model, path):
+    """フィルタのパスに渡す値を文字列から変換する関数を返す (変換しない場合はNone)
+
+    変換できない値ではValidationErrorを送出する。
+    """
+    steps, rest = resolve_path(model, path)
+    if not steps or len(rest) > 1:
+        # 関数やトランスフォームを含むパスはDjangoに任せる
+        return None
+    lookup = rest[0] if rest else "exact"
+    if lookup in TEXT_LOOKUPS:
+        return None
+    if lookup == "isnull":
+        return parse_bool
+    if lookup in PART_LOOKUPS:
+        return int
+
+    name, kind, field = steps[-1]
+    field = _get_target_field(kind, field)
+    if field.get_internal_type() in ("BooleanField", "NullBooleanField"):
+        to_python = parse_bool
+    else:
+        to_python = field.to_python
+
+    if lookup == "in":
+        return lambda value: [to_python(v) for v in _split_values(value)]
+    if lookup == "range":
+        def coerce_range(value):
+            values = _split_values(value)
+            if len(values) != 2:
+                raise ValidationError("Range needs 2 values")
+            return [to_python(v) for v in values]
+        return coerce_range
+    return to_python
 
 
 class ModelJSONAPI(JSONAPI):
@@ -12,15 +134,138 @@ class ModelJSONAPI(JSONAPI):
     model = None
     model_name = None
     
+    # "name", ("population_gte", "population__gte") のようにパラメータ名とパスを指定する
+    # ("population", "population", ("gte", "lte", "in")) のように指定すると
+    # population__gte=などのパラメータも受け付ける
+    # 値はフィールドの型に変換され、__inと__rangeはカンマで区切る
     filters = ()
     order_fields = ()
 
+    # per_pageだけが指定された場合にカーソルによるページネーションを行う
+    cursor_pagination = False
+
+    # ページネーションのtotalの求め方
+    # "exact": COUNT(*), "cached": COUNT(*)の結果をcount_cache_timeout秒キャッシュする,
+    # "estimate": PostgreSQLの統計情報による推定値, "none": 数えずにhas_nextを返す
+    count_mode = "exact"
+    count_cache_timeout = 60
+
+    # 追加をbulk_createでまとめて行う
+    bulk_add = False
+    bulk_batch_size = None
+
+    # fieldsが全てカラムであればvalues_list()で必要なカラムだけを取得する
+    # _item_to_dict, _getattr, json_serializeをオーバーライドした場合は用いない
+    fetch_values = True
+
+    # select_related/prefetch_relatedに渡すパス
+    # Noneの場合はfieldsとfiltersから推定する
+    select_related = None
+    prefetch_related = None
+
+    # include=で"linked"に含められる外部キー
+    # ("prefecture", ("carrier", CarrierJSONAPI())) のように出力に用いるAPIも指定できる
+    # 指定しない場合は参照先のモデルにregister_apiで登録したAPIを用いる
+    includes = ()
+
     def __init__(self):
         # モデル名をModelクラスから自動生成する
         if not self.model_name:
             self.model_name = self.model.__name__.lower() + "s"  # FIXME:正しい複数形を生成する
         super(ModelJSONAPI, self).__init__()
 
+        select_related, prefetch_related = self._infer_related_lookups()
+        if self.select_related is not None:
+            select_related = tuple(self.select_related or ())
+        if self.prefetch_related is not None:
+            prefetch_related = tuple(self.prefetch_related or ())
+        self._select_related_lookups = select_related
+        self._prefetch_related_lookups = prefetch_related
+
+        self._serializer_overridden = any(_get_function(type(self), name) is not _get_function(ModelJSONAPI, name)
+                                          for name in ("_item_to_dict", "_getattr", "json_serialize"))
+        self._includes = self._compile_includes()
+        self._filter_table = self._compile_filters()
+        self._order_table = self._compile_order_fields()
+        _apis.add(self)
+
+    def _compile_filters(self):
+        """filtersを{パラメータ名: (パス, 値の変換関数)}の辞書に変換する"""
+        table = {}
+        for f in self.filters:
+            if isinstance(f, (list, tuple)):
+                attr, field = f[0], f[1]
+                lookups = f[2] if len(f) > 2 else ()
+            else:
+                attr = field = f
+                lookups = ()
+            table[attr] = (field, get_filter_coerce(self.model, field))
+            for lookup in lookups:
+                path = field + "__" + lookup
+                table[attr + "__" + lookup] = (path, get_filter_coerce(self.model, path))
+        return table
+
+    def _compile_order_fields(self):
+        """order_fieldsを{sortパラメータの値: order_byに渡す値}の辞書に変換する"""
+        table = {}
+        for f in self.order_fields:
+            if isinstance(f, (list, tuple)):
+                attr, field = f[0], f[1]
+            else:
+                attr = field = f
+            table[attr] = table["+" + attr] = field
+            table["-" + attr] = "-" + field
+        return table
+
+    def _compile_includes(self):
+        """includesを{名前: (外部キー, 参照先のモデル, API)}の辞書に変換する"""
+        includes = OrderedDict()
+        for include in self.includes:
+            if isinstance(include, (list, tuple)):
+                name, api = include
+            else:
+                name, api = include, None
+            steps, rest = resolve_path(self.model, name)
+            if rest or len(steps) != 1 or steps[0][1] != SINGLE or \
+                    not getattr(steps[0][2], "attname", None):
+                raise ImproperlyConfigured(
+                    "'%s' in %s.includes is not a foreign key." % (name, type(self).__name__))
+            field = steps[0][2]
+            includes[name] = (field, classify_field(field)[1], api)
+        return includes
+
+    def _infer_related_lookups(self):
+        """fieldsとfiltersのパスから関連オブジェクトの読み込み方を推定する"""
+        paths = []
+        for accessor in self._get_field_plan():
+            paths.append(("__".join(accessor.path), True))
+        for f in self.filters:
+            paths.append((f[1] if isinstance(f, (list, tuple)) else f, False))
+
+        select_related = []
+        prefetch_related = []
+        for path, is_field in paths:
+            steps, rest = resolve_path(self.model, path)
+            names = []
+            is_multi = False
+            for i, (name, kind, field) in enumerate(steps):
+                if kind == COLUMN:
+                    break
+                if kind == SINGLE and not is_field and i == len(steps) - 1:
+                    # フィルタでは外部キーの値だけを用いるので読み込まない
+                    break
+                names.append(name)
+                is_multi = is_multi or kind == MULTI
+
+            if not names or (is_multi and not is_field):
+                # フィルタのための多対多の関係は読み込まない
+                continue
+            lookups = prefetch_related if is_multi else select_related
+            lookup = "__".join(names)
+            if lookup not in lookups:
+                lookups.append(lookup)
+        return tuple(select_related), tuple(prefetch_related)
+
 
     """リクエスト処理関係"""
 
@@ -29,67 +274,203 @@ class ModelJSONAPI(JSONAPI):
         return FormClass(data, instance=item)
 
     """シリアライズ関係"""
+    def _get_value_columns(self, fields=None):
+        """values_list()で取得するカラムのタプルを返す (取得できない場合はNone)"""
+        columns_cache = self._get_class_cache("_value_columns")
+        plan = self._get_field_plan(fields)
+        columns = columns_cache.get(plan, False)
+        if columns is not False:
+            return columns
+
+        columns = []
+        for accessor in plan:
+            path = "__".join(accessor.path)
+            steps, rest = resolve_path(self.model, path)
+            if rest or any(kind not in (COLUMN, SINGLE) for name, kind, field in steps):
+                # プロパティや関数、多対多の関係を含む
+                columns = None
+                break
+            name, kind, field = steps[-1]
+            if kind == SINGLE and not _get_target_field(kind, field).primary_key:
+                # to_fieldの値ではなく参照先のidを出力する
+                columns = None
+                break
+            columns.append(path)
+        if columns is not None:
+            columns = tuple(columns)
+        columns_cache.set(plan, columns)
+        return columns
+
+    def _uses_value_columns(self, items, fields=None):
+        """itemsをモデルのインスタンスを生成せずにvalues_listで取得するか"""
+        return self.fetch_values and not self._serializer_overridden and self.row_cache_timeout is None and \
+            not self._prefetch_related_lookups and isinstance(items, QuerySet) and \
+            self._get_value_columns(fields) is not None
+
+    def _prepare_items(self, items, fields=None, includes=()):
+        if self._uses_value_columns(items, fields):
+            # 指定されたfieldsのカラムだけを取得する
+            columns = self._get_value_columns(fields)
+            # モデルのインスタンスを生成せずにタプルから辞書を作る
+            names = [accessor.name for accessor in self._get_field_plan(fields)]
+            def row_to_dict(row):
+                return OrderedDict(zip(names, row))
+            # get_linkedのためにincludesの外部キーを末尾に加える
+            columns += tuple(self._get_include_attnames(includes))
+            return items.values_list(*columns), row_to_dict
+        return super(ModelJSONAPI, self)._prepare_items(items, fields, includes)
+
     def json_serialize(self, obj):
         """JSONに変換できないオブジェクトを変換"""
         if isinstance(obj,Model):
             return obj.id
         return super(ModelJSONAPI,self).json_serialize(obj)
     
-    def response(self, data):
+    def get_includes(self, request):
+        names = request.GET.get("include")
+        if not names:
+            return ()
+        includes = []
+        for name in names.split(","):
+            name = name.strip()
+            if not name or name in includes:
+                continue
+            if name not in self._includes:
+                return HttpResponseBadRequest("Unknown include: %s" % name)
+            includes.append(name)
+        return includes
+
+    def _get_include_attnames(self, includes):
+        return [self._includes[name][0].attname for name in includes]
+
+    def get_linked(self, request, items, includes):
+        """includesの参照先を{include名: データのリスト}の辞書で返す
+
+        itemsはモデルのインスタンス(のリスト)か、_prepare_itemsで取得した外部キーを末尾に持つタプルのリスト
+        """
+        attnames = self._get_include_attnames(includes)
+        if isinstance(items, QuerySet):
+            rows = items.values_list(*attnames)
+        else:
+            if not isinstance(items, (list, tuple)):
+                items = [items]
+            rows = [row[len(row) - len(attnames):] if isinstance(row, tuple) else
+                    [getattr(row, attname) for attname in attnames] for row in items]
+
+        # includeごとのIDを求め、参照先のAPIごとにまとめて取得する
+        include_ids = [set() for name in includes]
+        for row in rows:
+            for ids, value in zip(include_ids, row):
+                if value is not None:
+                    ids.add(value)
+        apis = OrderedDict()
+        for name, ids in zip(includes, include_ids):
+            apis.setdefault(self._get_include_api(name), set()).update(ids)
+        related = dict((api, api.get_items_by_ids(request, sorted(ids))) for api, ids in apis.items())
+
+        linked = OrderedDict()
+        for name, ids in zip(includes, include_ids):
+            api = self._get_include_api(name)
+            items = [related[api][id] for id in sorted(ids) if id in related[api]]
+            linked[name] = api._items_to_dict(items)[api.model_name]
+        return linked
+
+    def _get_include_api(self, name):
+        field, related_model, api = self._includes[name]
+        if api is None:
+            api = get_api_for_model(related_model)
+            if api is None:
+                raise ImproperlyConfigured("No API is registered for %s. Use register_api() or "
+                                           "specify the API in includes." % related_model.__name__)
+        return api
+
+    def get_metadata(self, request=None):
+        metadata = super(ModelJSONAPI,self).get_metadata(request)
         if settings.DEBUG == True:
             from django.db import connection
-            self.metadata["queries"] = connection.queries
-        return super(ModelJSONAPI,self).response(data)
+            metadata["queries"] = connection.queries
+        return metadata
 
     """データ取得処理関係"""
+    def get_id_converter(self):
+        converter = super(ModelJSONAPI, self).get_id_converter()
+        if converter != "int":
+            return converter
+        # 主キーの型に合わせる (多テーブル継承では親の主キー)
+        pk = self.model._meta.pk
+        while classify_field(pk)[0] == SINGLE:
+            pk = _get_target_field(SINGLE, pk)
+        internal_type = pk.get_internal_type()
+        if internal_type.endswith(("AutoField", "IntegerField")):
+            return "int"
+        if internal_type == "UUIDField":
+            return "uuid"
+        return "str"
+
     def get_queryset(self, request):
         return self.model.objects.all()
 
+    def _apply_related_lookups(self, queryset):
+        if self._select_related_lookups:
+            queryset = queryset.select_related(*self._select_related_lookups)
+        if self._prefetch_related_lookups:
+            queryset = queryset.prefetch_related(*self._prefetch_related_lookups)
+        return queryset
+
+    def _get_filter_dict(self, request):
+        """filterに渡す辞書を返す (値が不正な場合はHttpResponseBadRequest)"""
+        filter_dict = {}
+        for attr in request.GET:
+            spec = self._filter_table.get(attr)
+            if spec is None:
+                continue
+            value = request.GET.get(attr)
+            if not value:
+                continue
+            field, coerce = spec
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except (ValidationError, ValueError, TypeError):
+                    return HttpResponseBadRequest("Invalid value for %s" % attr)
+            filter_dict[field] = value
+        return filter_dict
+
     def get_items_for_request(self, request):
-        queryset = self.get_queryset(request)
+        filter_dict = self._get_filter_dict(request)
+        if isinstance(filter_dict, HttpResponse):
+            return filter_dict
+        queryset, order_by_list = self._get_sorted_queryset(request, filter_dict)
+
+        # ページネーション
+        per_page, page = self._get_page_params(request)
+        if per_page > 0:
+            if self._use_cursor(request):
+                queryset = self._paginate_by_cursor(request, queryset, order_by_list, per_page)
+            else:
+                queryset = self._paginate_by_page(request, queryset, per_page, page)
+        return queryset
+
+    def _get_sorted_queryset(self, request, filter_dict):
+        """フィルタとソートを適用したQuerySetとソート順のリストを返す (クエリは実行しない)"""
+        queryset = self._apply_related_lookups(self.get_queryset(request))
         
         # フィルタリング
-        filter_dict = {}
-        for f in self.filters:
-            if isinstance(f,(list,tuple)):
-                attr = f[0]
-                field = f[1]
-            else:
-                attr = field = f
-            
-            value = request.GET.get(attr)
-            if value:
-                filter_dict[field] = value
-        queryset = queryset.filter(**filter_dict)
+        if filter_dict:
+            queryset = queryset.filter(**filter_dict)
         
         # ソート
-        order_fields_dict = {}
-        for f in self.order_fields:
-            if isinstance(f,(list,tuple)):
-                attr = f[0]
-                field = f[1]
-            else:
-                attr = field = f
-            order_fields_dict[attr] = field
-        
         order_by_list = []
-        sorts = request.GET.getlist("sort")
-        sort_re = re.compile("^([+-]?)(.+)$")
-        for sort in sorts:
-            match = sort_re.match(sort)
-            if match:
-                order, attr = match.groups()
-                if attr in order_fields_dict:
-                    field = order_fields_dict[attr]
-                    if order == "-":
-                        field = "-" + field
-                    order_by_list.append(field)
+        for sort in request.GET.getlist("sort"):
+            field = self._order_table.get(sort)
+            if field is not None:
+                order_by_list.append(field)
 
         if order_by_list:
             queryset = queryset.order_by(*order_by_list)
-        
-        
-        # ページネーション
+        return queryset, order_by_list
+
+    def _get_page_params(self, request):
         per_page = 0
         page = 1
         try:
@@ -97,35 +478,315 @@ class ModelJSONAPI(JSONAPI):
             page = int(request.GET.get("page","1"))
         except ValueError:
             pass
-        if per_page > 0:
-            paginator = Paginator(queryset,per_page)
-            if page not in paginator.page_range:
-                page = 1
-            page = paginator.page(page)
-            queryset = page.object_list
-            self.metadata.update({
-                                  "total":paginator.count,
-                                  "per_page":per_page,
-                                  "page":page.number
-                                  })
+        return per_page, page
+
+    def _use_cursor(self, request):
+        return "cursor" in request.GET or (self.cursor_pagination and "page" not in request.GET)
+
+    def _paginate_by_page(self, request, queryset, per_page, page):
+        queryset = self._get_page_queryset(queryset)
+        if self.count_mode == "none":
+            pks = list(self._get_page_pks(queryset, per_page, page))
+            return self._page_by_pks(request, queryset, per_page, page, pks)
+        return self._page_by_total(request, queryset, per_page, page, self._count_items(queryset))
+
+    def _get_page_queryset(self, queryset):
+        if not queryset.ordered:
+            # 順序が不定だとページ間や関連データの取得で行が食い違う
+            queryset = queryset.order_by("pk")
         return queryset
 
+    def _get_page_pks(self, queryset, per_page, page):
+        """ページのpkを1件多く取得するQuerySet (count_mode="none")"""
+        offset = (max(page, 1) - 1) * per_page
+        return queryset.values_list("pk", flat=True)[offset:offset + per_page + 1]
+
+    def _page_by_pks(self, request, queryset, per_page, page, pks):
+        # 1件多く取得できれば次のページがある
+        self.get_context(request).pagination.update({
+            "per_page": per_page,
+            "page": max(page, 1),
+            "has_next": len(pks) > per_page,
+        })
+        return queryset.filter(pk__in=pks[:per_page])
+
+    def _page_by_total(self, request, queryset, per_page, page, total):
+        num_pages = max(1, (total + per_page - 1) // per_page)
+        if page < 1 or (page > num_pages and self.count_mode != "estimate"):
+            # 推定値の場合は範囲外でもそのページを返す
+            page = 1
+        self.get_context(request).pagination.update({
+            "total": total,
+            "per_page": per_page,
+            "page": page,
+        })
+        offset = (page - 1) * per_page
+        return queryset[offset:offset + per_page]
+
+    def _count_items(self, queryset):
+        """count_modeに従って件数を返す"""
+        if self.count_mode == "estimate":
+            count = self._estimate_count(queryset)
+            if count is not None:
+                return count
+        elif self.count_mode == "cached":
+            try:
+                sql, params = queryset.order_by().query.sql_with_params()
+            except EmptyResultSet:
+                return 0
+            key = "%s:%s:%r" % (queryset.db, sql, params)
+            key = "jsonapi:count:%s" % hashlib.md5(key.encode("utf-8")).hexdigest()
+            cache = self._get_cache()
+            count = cache.get(key)
+            if count is None:
+                count = queryset.count()
+                cache.set(key, count, self.count_cache_timeout)
+            return count
+        return queryset.count()
+
+    def _estimate_count(self, queryset):
+        """PostgreSQLの統計情報から件数を推定する (推定できない場合はNone)"""
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+
+        cursor = connection.cursor()
+        try:
+            if not queryset.query.where:
+                # フィルタがなければテーブルの行数の推定値を用いる
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                count = int(row[0]) if row else -1
+            else:
+                try:
+                    sql, params = queryset.order_by().query.sql_with_params()
+                except EmptyResultSet:
+                    return 0
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+                if not isinstance(plan, list):
+                    plan = json.loads(plan)
+                count = int(plan[0]["Plan"]["Plan Rows"])
+        finally:
+            cursor.close()
+
+        if count < 0:
+            # ANALYZEされていないテーブル
+            return None
+        return count
+
+    def _paginate_by_cursor(self, request, queryset, order_by_list, per_page):
+        """カーソル(キーセット)によるページネーション
+
+        ソート順とidの値で次のページの先頭を探すため、件数のクエリやOFFSETを用いない。
+        ソートに用いるフィールドにNULLが含まれる場合は正しく動作しない。
+        """
+        keyset, state = self._get_cursor_keyset(request, queryset, order_by_list, per_page)
+        return self._page_by_cursor(request, queryset, per_page, list(keyset), state)
+
+    def _get_cursor_keyset(self, request, queryset, order_by_list, per_page):
+        """カーソル以降の行を1件多く取得するQuerySetと、ページの組み立てに用いる状態を返す"""
+        ordering = list(order_by_list)
+        if not set(f.lstrip("-") for f in ordering) & set(("pk", "id")):
+            # 同じ値の行を区別するためにidでもソートする
+            ordering.append("pk")
+        names = [f.lstrip("-") for f in ordering]
+
+        direction, values = self._decode_cursor(request.GET.get("cursor"), names)
+        previous = direction == "p"
+
+        # 前のページは逆順に取得する
+        descending = [f.startswith("-") != previous for f in ordering]
+        keyset = queryset
+        if values is not None:
+            q = None
+            for i, name in enumerate(names):
+                condition = dict(zip(names[:i], values[:i]))
+                condition[name + ("__lt" if descending[i] else "__gt")] = values[i]
+                q = Q(**condition) if q is None else q | Q(**condition)
+            keyset = keyset.filter(q)
+        keyset = keyset.order_by(*[("-" if d else "") + name for name, d in zip(names, descending)])
+
+        # 1件多く取得して続きがあるか判定する
+        return keyset.values_list("pk", *names)[:per_page + 1], (ordering, previous, values)
+
+    def _page_by_cursor(self, request, queryset, per_page, rows, state):
+        ordering, previous, values = state
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if previous:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if has_more or previous:
+                next_cursor = self._encode_cursor("n", rows[-1][1:])
+            if (has_more and previous) or (values is not None and not previous):
+                prev_cursor = self._encode_cursor("p", rows[0][1:])
+        self.get_context(request).pagination.update({
+            "per_page": per_page,
+            "next": next_cursor,
+            "prev": prev_cursor,
+        })
+        return queryset.filter(pk__in=[row[0] for row in rows]).order_by(*ordering)
+
+    def _encode_cursor(self, direction, values):
+        data = json.dumps([direction, list(values)], default=self.json_serialize)
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, cursor, names):
+        """カーソルを(方向, 値のリスト)に変換する (不正な場合は先頭ページとする)"""
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(str(cursor)).decode("utf-8"))
+        except (ValueError, TypeError, UnicodeError):
+            return None, None
+        if direction not in ("n", "p") or not isinstance(values, list) or len(values) != len(names):
+            return None, None
+        try:
+            values = [self._cursor_to_python(name, value) for name, value in zip(names, values)]
+        except (ValueError, TypeError, ValidationError):
+            return None, None
+        return direction, values
+
+    def _cursor_to_python(self, name, value):
+        """カーソルの値をソートするフィールドの型に変換する"""
+        if isinstance(value, (list, dict)):
+            raise TypeError(value)
+        steps, rest = resolve_path(self.model, name)
+        if not steps or rest:
+            return value
+        field = _get_target_field(*steps[-1][1:])
+        return field.to_python(value)
+
+    def get_items_by_ids(self, request, ids):
+        return self.get_queryset(request).in_bulk(ids)
+
     def get_item_by_id(self, request, id):
-        return get_object_or_404(self.get_queryset(request), id=id)
+        queryset = self._apply_related_lookups(self.get_queryset(request))
+        return get_object_or_404(queryset, id=id)
 
     """データ更新関係"""
+    def _has_save_signals(self):
+        return pre_save.has_listeners(self.model) or post_save.has_listeners(self.model)
+
+    def _can_bulk_create(self):
+        """bulk_createで追加できるか (シグナルやsave()のオーバーライド、多テーブル継承がなく、主キーを取得できる)"""
+        if self.model._meta.parents or self._has_save_signals() or self._overrides_save():
+            return False
+        features = connections[router.db_for_write(self.model)].features
+        return bool(getattr(features, "can_return_rows_from_bulk_insert", False) or
+                    getattr(features, "can_return_ids_from_bulk_insert", False))
+
     def process_add_items(self, request, forms):
-        items = []
-        for form in forms:
-            items.append(form.save())
+        if not self.bulk_add:
+            items = []
+            for form in forms:
+                items.append(form.save())
+            return items
+
+        # 1つのトランザクションでまとめて追加する
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            if self._can_bulk_create():
+                items = [form.save(commit=False) for form in forms]
+                self.model.objects.bulk_create(items, batch_size=self.bulk_batch_size)
+                for form in forms:
+                    form.save_m2m()
+            else:
+                items = [form.save() for form in forms]
         return items
 
     def process_update_item(self, request, form):
         item = form.save()
         return item
 
+    def get_cache_version_namespace(self):
+        # 同じモデル (プロキシモデルを含む) のAPIでキャッシュの無効化を共有する
+        opts = self.model._meta.concrete_model._meta
+        return "%s.%s" % (opts.app_label, opts.object_name)
+
+    def _get_write_db(self):
+        return router.db_for_write(self.model)
+
+    def _overrides_save(self):
+        return _get_function(self.model, "save") is not _get_function(Model, "save")
+
+    def _can_bulk_update(self, request):
+        """bulk_updateで変更できるか
+
+        シグナルやsave()、process_update_itemのオーバーライドがなく、PATCHでない
+        """
+        if _get_function(type(self), "process_update_item") is not _get_function(ModelJSONAPI, "process_update_item"):
+            return False
+        return not (self._has_save_signals() or self._overrides_save() or request.method == "PATCH")
+
+    def process_update_items(self, request, forms):
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            if not self._can_bulk_update(request):
+                # 1件ずつprocess_update_itemで変更する
+                return super(ModelJSONAPI, self).process_update_items(request, forms)
+
+            # 変更されたフィールドだけをまとめて更新する
+            opts = self.model._meta
+            concrete_fields = set(f.name for f in opts.fields if not f.primary_key)
+            # auto_nowのフィールドはsave()と同じく変更のたびに更新する
+            auto_now_fields = [f for f in opts.fields if getattr(f, "auto_now", False)]
+            update_fields = set()
+            changed_items = []
+            items = []
+            for form in forms:
+                item = form.save(commit=False)
+                changed_fields = [f for f in form.changed_data if f in concrete_fields]
+                if changed_fields:
+                    for field in auto_now_fields:
+                        field.pre_save(item, False)
+                        changed_fields.append(field.name)
+                    update_fields.update(changed_fields)
+                    changed_items.append(item)
+                items.append(item)
+            update_fields = sorted(update_fields)
+
+            if changed_items:
+                if hasattr(QuerySet, "bulk_update"):
+                    self.model.objects.bulk_update(changed_items, update_fields,
+                                                   batch_size=self.bulk_batch_size)
+                else:
+                    # Django < 2.2
+                    for item in changed_items:
+                        item.save(update_fields=update_fields)
+            for form in forms:
+                form.save_m2m()
+        return items
+
     def process_delete_item(self, request, item):
         item.delete()
         return None
 
+    def process_delete_items(self, request, ids):
+        """1つのクエリでまとめて削除する (process_delete_itemは呼ばれない)"""
+        queryset = self.get_queryset(request)
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        else:
+            filter_dict = self._get_filter_dict(request)
+            if isinstance(filter_dict, HttpResponse):
+                return filter_dict
+            if not filter_dict:
+                # 全件の削除は受け付けない
+                return HttpResponseBadRequest("No ids or filters")
+            queryset = queryset.filter(**filter_dict)
+
+        with transaction.atomic(using=queryset.db):
+            if django.VERSION < (1, 9):
+                # 削除した件数を返さない
+                count = queryset.count()
+                queryset.delete()
+            elif Collector(using=queryset.db).can_fast_delete(queryset):
+                # カスケードやシグナルがなければ直接DELETEする
+                count = queryset._raw_delete(queryset.db)
+            else:
+                deleted, deleted_per_model = queryset.delete()
+                count = deleted_per_model.get(self.model._meta.label, 0)
+        return count
+
 
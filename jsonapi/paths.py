@@ -0,0 +1,92 @@
+# encoding=utf-8
+from django.db.models.fields import Field
+from django.db.models.fields.related import ForeignKey, ManyToManyField, OneToOneField
+
+try:
+    from django.core.exceptions import FieldDoesNotExist
+except ImportError:  # Django < 1.8
+    from django.db.models.fields import FieldDoesNotExist
+
+
+# パスの各要素の種類
+COLUMN = "column"  # 通常のカラム
+SINGLE = "single"  # ForeignKey, OneToOneField (逆参照を含む)
+MULTI = "multi"  # ManyToManyField, ForeignKeyの逆参照
+
+
+def _get_reverse_relation(opts, accessor_name):
+    """`user_set`のようなアクセサ名から逆参照を取得する"""
+    if hasattr(opts, "get_fields"):
+        relations = [f for f in opts.get_fields()
+                     if f.auto_created and not f.concrete and hasattr(f, "get_accessor_name")]
+    else:
+        # Django < 1.8
+        relations = opts.get_all_related_objects() + opts.get_all_related_many_to_many_objects()
+
+    for relation in relations:
+        if relation.get_accessor_name() == accessor_name:
+            return relation
+    raise FieldDoesNotExist(accessor_name)
+
+
+def get_field(model, name):
+    """名前からフィールドを取得する (逆参照を含む)"""
+    opts = model._meta
+    if name == "pk":
+        return opts.pk
+    try:
+        if hasattr(opts, "get_fields"):
+            return opts.get_field(name)
+        return opts.get_field_by_name(name)[0]  # Django < 1.8
+    except FieldDoesNotExist:
+        return _get_reverse_relation(opts, name)
+
+
+def _related_model(field):
+    model = getattr(field, "related_model", None)
+    if model is None:
+        model = field.rel.to  # Django < 1.8
+    return model
+
+
+def classify_field(field):
+    """フィールドの種類と参照先のモデルを返す"""
+    if isinstance(field, ManyToManyField):
+        return MULTI, _related_model(field)
+    if isinstance(field, ForeignKey):
+        return SINGLE, _related_model(field)
+    if isinstance(field, Field):
+        if getattr(field, "column", None):
+            return COLUMN, None
+        return None, None  # GenericRelationなど
+
+    # 逆参照
+    if getattr(field, "field", None) is None:
+        return None, None
+    if hasattr(field, "one_to_one"):
+        return (SINGLE if field.one_to_one else MULTI), field.related_model
+    # Django < 1.8 (RelatedObject)
+    return (SINGLE if isinstance(field.field, OneToOneField) else MULTI), field.model
+
+
+def resolve_path(model, path):
+    """`__`区切りのパスをモデルのフィールドに解決する
+
+    ((名前, 種類, フィールド) のリスト, 解決できなかった残りの名前のリスト) を返す
+    """
+    steps = []
+    names = path.split("__")
+    for i, name in enumerate(names):
+        if model is None:
+            return steps, names[i:]
+        try:
+            field = get_field(model, name)
+        except FieldDoesNotExist:
+            return steps, names[i:]
+
+        kind, related_model = classify_field(field)
+        if kind is None:
+            return steps, names[i:]
+        steps.append((name, kind, field))
+        model = related_model
+    return steps, []
@@ -0,0 +1,392 @@
+# encoding=utf-8
+from collections import OrderedDict
+import copy
+from inspect import iscoroutine, iscoroutinefunction
+from itertools import count
+import json
+import re
+import threading
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.db import close_old_connections, transaction
+from django.http import QueryDict
+from django.http.response import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, \
+    Http404
+from django.utils.http import urlencode
+
+from jsonapi.encoders import get_decoder
+
+try:
+    from django.urls import path, register_converter
+except ImportError:  # Django < 2.0
+    path = register_converter = None
+try:
+    from django.urls import re_path
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url as re_path
+
+
+# idのコンバーターと正規表現 (Django < 2.0)
+ID_PATTERNS = OrderedDict([
+    ("int", "[0-9]+"),
+    ("uuid", "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"),
+    ("str", "[^/]+"),
+])
+
+ID_REGEXES = dict((name, re.compile("^(?:%s)$" % pattern)) for name, pattern in ID_PATTERNS.items())
+
+# 一括リクエストで受け付けるメソッド
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+
+# コンバーターの名前を重複させないための連番
+_converter_ids = count()
+
+
+class BatchRollback(Exception):
+    """一括リクエストのトランザクションを取り消す"""
+    pass
+
+
+class ResourceConverter(object):
+    """リソース名のコンバーター
+
+    登録されていない名前はValueErrorとし、他のURLパターンを試させる
+    """
+    regex = "[^/]+"
+    names = frozenset()
+
+    def to_python(self, value):
+        if value not in self.names:
+            raise ValueError(value)
+        return value
+
+    def to_url(self, value):
+        if value not in self.names:
+            raise ValueError(value)
+        return value
+
+
+class Router(object):
+    """複数のJSONAPIのURLを1つのルート表にまとめる
+
+        router = Router()
+        router.register(prefectures)
+        router.register(users, "people")
+        urlpatterns = [path("api/", include(router.urls))]
+
+    リソース名で辞書を引いてAPIのビューを呼び出すため、URLパターンの数はAPIの数によらない。
+    idのコンバーター、同期/非同期、CSRFの扱いが異なるAPIは別のURLパターンになる。
+    """
+
+    # 一括リクエストのURL (`batch/`) の名前 (Noneの場合は一括リクエストを受け付けない)
+    batch_name = "batch"
+    # 一括リクエストで実行できる操作の最大数
+    batch_max_operations = 50
+    # 一括リクエストのボディの最大バイト数 (Noneは無制限)
+    # 既定値はDjangoのDATA_UPLOAD_MAX_MEMORY_SIZEと同じ
+    batch_max_body_size = 2621440
+    # 一括リクエストのボディのデコーダ ("auto", "json", "orjson", "ujson")
+    json_decoder = "auto"
+    # 書き込みを含む一括リクエストを1つのトランザクションで実行する
+    # (リクエストの{"atomic": true}でも指定できる)
+    batch_atomic = False
+    # トランザクションに用いるデータベース (Noneは"default")
+    batch_using = None
+    # GETだけの一括リクエストを並列に実行するスレッド数 (0は順番に実行する)
+    # ワーカーのスレッドは別のデータベース接続を用いるため、ATOMIC_REQUESTSなどの
+    # 呼び出し元のトランザクションの外で実行され、その中で変更したデータは参照できない
+    batch_workers = 0
+
+    def __init__(self):
+        self._registry = OrderedDict()
+        self._urls = None
+        self._views = {}
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def register(self, api, name=None):
+        """APIをリソース名 (省略時はmodel_name) で登録する"""
+        if self._urls is not None:
+            raise ImproperlyConfigured("Cannot register an API after the urls are generated.")
+        if name is None:
+            name = api.model_name
+        if name == self.batch_name:
+            raise ImproperlyConfigured("Resource name '%s' is used for batch requests." % name)
+        if "/" in name:
+            raise ImproperlyConfigured("Resource name '%s' contains '/'." % name)
+        if name in self._registry:
+            raise ImproperlyConfigured("Resource '%s' is already registered." % name)
+        self._registry[name] = api
+        return api
+
+    def get_api(self, name):
+        """リソース名に登録されたAPIを返す (登録されていない場合はNone)"""
+        return self._registry.get(name)
+
+    def _get_routes(self):
+        """{(コンバーター, 非同期か, csrf_exempt): {リソース名: (一覧のビュー, 1件のビュー)}}"""
+        routes = OrderedDict()
+        for name, api in self._registry.items():
+            index_view = api.wrap_view(api.request_index)
+            item_view = api.wrap_view(api.request_item)
+            key = (api.get_id_converter(), iscoroutinefunction(index_view),
+                   getattr(index_view, "csrf_exempt", False))
+            routes.setdefault(key, OrderedDict())[name] = (index_view, item_view)
+        return routes
+
+    def get_urls(self):
+        urlpatterns = []
+        routes = self._get_routes()
+        self._views = {}
+        for (converter, is_async, csrf_exempt), views in routes.items():
+            for name, (index_view, item_view) in views.items():
+                self._views[name] = (index_view, item_view, converter)
+
+        if self.batch_name is not None:
+            batch_view = self.wrap_batch_view(self.batch)
+            # 全てのAPIがCSRFの検証を行わない場合だけ検証しない
+            batch_view.csrf_exempt = all(csrf_exempt for converter, is_async, csrf_exempt in routes)
+            if path is not None:
+                urlpatterns.append(path("%s/" % self.batch_name, batch_view, name="jsonapi_batch"))
+            else:
+                urlpatterns.append(re_path(r"^%s/$" % re.escape(self.batch_name), batch_view,
+                                           name="jsonapi_batch"))
+
+        for (converter, is_async, csrf_exempt), views in routes.items():
+            index_view = _make_view(views, 0, is_async)
+            item_view = _make_view(views, 1, is_async)
+            index_view.csrf_exempt = item_view.csrf_exempt = csrf_exempt
+
+            if path is not None:
+                resource = "jsonapi_resource_%d" % next(_converter_ids)
+                register_converter(type("ResourceConverter", (ResourceConverter,),
+                                        {"names": frozenset(views)}), resource)
+                urlpatterns += [
+                    path("<%s:resource>/" % resource, index_view, name="jsonapi_index"),
+                    path("<%s:resource>/<%s:id>/" % (resource, converter), item_view,
+                         name="jsonapi_item"),
+                ]
+            else:
+                # Django < 2.0
+                resource = "(?P<resource>%s)" % "|".join(re.escape(name) for name in views)
+                id_pattern = ID_PATTERNS.get(converter, ID_PATTERNS["str"])
+                urlpatterns += [
+                    re_path(r"^%s/$" % resource, index_view, name="jsonapi_index"),
+                    re_path(r"^%s/(?P<id>%s)/$" % (resource, id_pattern), item_view,
+                            name="jsonapi_item"),
+                ]
+        return urlpatterns
+
+    def urls(self):
+        # ルート表は最初に参照された時に一度だけ生成する
+        if self._urls is None:
+            self._urls = self.get_urls()
+        return self._urls
+    urls = property(urls)
+
+    """一括リクエスト関係"""
+
+    def wrap_batch_view(self, view_func):
+        def view(request, *args, **kwargs):
+            return view_func(request, *args, **kwargs)
+        return view
+
+    def batch(self, request):
+        """複数の操作を1つのリクエストで実行する
+
+        [{"method": "GET", "resource": "users", "id": 1, "query": {"fields": "id"}, "body": null}, ...]
+        または{"atomic": true, "operations": [...]}を受け取り、
+        {"results": [{"status": 200, "body": {...}}, ...]}を返す。
+        atomicの場合は失敗した操作で中断して全ての変更を取り消し、その操作のステータスを返す。
+        """
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        if self.batch_max_body_size is not None:
+            # 読み込む前にContent-Lengthで判定する
+            try:
+                length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                length = 0
+            if length > self.batch_max_body_size or len(request.body) > self.batch_max_body_size:
+                return HttpResponse("Request body too large", status=413)
+        try:
+            payload = get_decoder(self.json_decoder)(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("Bad struct")
+
+        atomic = self.batch_atomic
+        if isinstance(payload, dict):
+            atomic = bool(payload.get("atomic", atomic))
+            payload = payload.get("operations")
+        if not isinstance(payload, list):
+            return HttpResponseBadRequest("Bad struct")
+        if len(payload) > self.batch_max_operations:
+            return HttpResponseBadRequest("Too many operations")
+
+        operations = []
+        for data in payload:
+            operation = self._get_operation(data)
+            if operation is None:
+                return HttpResponseBadRequest("Bad operation")
+            operations.append(operation)
+
+        # ビューを生成する
+        self.urls
+        status = 200
+        read_only = all(operation[0] == "GET" for operation in operations)
+        if read_only and self.batch_workers > 0 and len(operations) > 1:
+            self._load_lazy_attributes(request)
+            responses = list(self._get_executor().map(
+                lambda operation: self._run_operation_in_thread(request, operation), operations))
+        elif atomic and not read_only:
+            responses = []
+            try:
+                with transaction.atomic(using=self.batch_using):
+                    for operation in operations:
+                        response = self._run_operation(request, operation, atomic=True)
+                        responses.append(response)
+                        if response.status_code >= 400:
+                            raise BatchRollback()
+            except BatchRollback:
+                status = responses[-1].status_code
+        else:
+            responses = [self._run_operation(request, operation) for operation in operations]
+
+        content = b", ".join(self._result_json(response) for response in responses)
+        return HttpResponse(b'{"results": [' + content + b']}', status=status,
+                            content_type="application/json")
+
+    def _get_operation(self, data):
+        """操作を(メソッド, リソース名, id, クエリ文字列, ボディ)に変換する (不正な場合はNone)"""
+        if not isinstance(data, dict):
+            return None
+        method = data.get("method", "GET")
+        resource = data.get("resource")
+        if not isinstance(method, str) or method.upper() not in BATCH_METHODS or \
+                not isinstance(resource, str):
+            return None
+
+        query = data.get("query") or ""
+        if isinstance(query, dict):
+            query = urlencode(query, doseq=True)
+        elif not isinstance(query, str):
+            return None
+
+        body = data.get("body")
+        body = json.dumps(body).encode("utf-8") if body is not None else b""
+        return method.upper(), resource, data.get("id"), query, body
+
+    def _make_request(self, request, method, query, body):
+        """元のリクエストのユーザーやヘッダを引き継いだリクエストを生成する"""
+        sub_request = copy.copy(request)
+        for name in ("_post", "_files", "_stream", "_jsonapi_contexts"):
+            sub_request.__dict__.pop(name, None)
+        sub_request.method = method
+        sub_request.META = request.META.copy()
+        sub_request.META.update({
+            "REQUEST_METHOD": method,
+            "QUERY_STRING": query,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+        })
+        sub_request.GET = QueryDict(query)
+        sub_request._body = body
+        return sub_request
+
+    def _run_operation(self, request, operation, atomic=False):
+        method, resource, id, query, body = operation
+        views = self._views.get(resource)
+        if views is None:
+            return HttpResponse("Unknown resource", status=404)
+        index_view, item_view, converter = views
+        sub_request = self._make_request(request, method, query, body)
+        if atomic:
+            # ロールバックされうるため、レスポンスや行をキャッシュしない
+            sub_request._jsonapi_atomic_batch = True
+        try:
+            if id is None:
+                response = index_view(sub_request)
+            else:
+                id = self._id_to_url_value(converter, id)
+                if id is None:
+                    return HttpResponse("Invalid id", status=404)
+                response = item_view(sub_request, id=id)
+            if iscoroutine(response):
+                # 非同期のAPI
+                from asgiref.sync import async_to_sync
+                response = async_to_sync(_await)(response)
+        except Http404:
+            return HttpResponse("Not found", status=404)
+        except PermissionDenied:
+            return HttpResponse("Permission denied", status=403)
+        return response
+
+    def _load_lazy_attributes(self, request):
+        """ユーザーとセッションを呼び出し元のスレッドで読み込む
+
+        遅延評価のままワーカーに渡すと、各スレッドが同時に評価してクエリを実行するため
+        """
+        user = getattr(request, "user", None)
+        if user is not None:
+            getattr(user, "pk", None)
+        session = getattr(request, "session", None)
+        if session is not None:
+            session.keys()
+
+    def _run_operation_in_thread(self, request, operation):
+        try:
+            return self._run_operation(request, operation)
+        finally:
+            # スレッドごとのデータベース接続を閉じる
+            close_old_connections()
+
+    def _id_to_url_value(self, converter, id):
+        """URLのコンバーターと同じ値に変換する (一致しない場合はNone)"""
+        id = str(id)
+        regex = ID_REGEXES.get(converter)
+        if regex is not None and not regex.match(id):
+            return None
+        if path is None:
+            return id  # Django < 2.0 は文字列のまま渡す
+        if converter == "int":
+            return int(id)
+        if converter == "uuid":
+            return uuid.UUID(id)
+        return id
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.batch_workers)
+            return self._executor
+
+    def _result_json(self, response):
+        if getattr(response, "streaming", False):
+            content = b"".join(response.streaming_content)
+        else:
+            content = response.content
+        if not content:
+            body = b"null"
+        elif response.get("Content-Type", "").startswith("application/json"):
+            body = content
+        else:
+            body = json.dumps(content.decode("utf-8", "replace")).encode("utf-8")
+        return b'{"status": %d, "body": ' % response.status_code + body + b'}'
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def _make_view(views, index, is_async):
+    """リソース名で辞書を引いてAPIのビューを呼び出すビュー"""
+    if is_async:
+        async def async_view(request, resource, **kwargs):
+            return await views[resource][index](request, **kwargs)
+        return async_view
+
+    def view(request, resource, **kwargs):
+        return views[resource][index](request, **kwargs)
+    return view
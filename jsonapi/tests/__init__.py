@@ -1,4 +1,4 @@
 # encoding=utf-8
 from jsonapi.tests.testcase import JSONAPITest
 from jsonapi.tests.testcase.forms import JSONAPIFormTest
-from jsonapi.tests.testcase.models import ModelJSONAPITest
+from jsonapi.tests.testcase.models import ModelJSONAPITest, AsyncModelJSONAPITest
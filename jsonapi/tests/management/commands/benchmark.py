@@ -0,0 +1,251 @@
+# encoding=utf-8
+import datetime
+import json
+import platform
+from optparse import make_option
+from timeit import default_timer
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+import jsonapi
+from jsonapi.encoders import ENCODERS, get_encoder
+from jsonapi.tests.models import Prefecture, User
+from jsonapi.tests.views import PrefectureJSONAPI, ModelPrefectureJSONAPI, ModelUserJSONAPI
+
+
+DEFAULT_ROWS = "10,1000,100000"
+DEFAULT_REPEAT = 5
+
+# 書き込みの計測に用いる件数
+WRITE_ROWS = 1000
+POST_ITEMS = 100
+
+
+def _base36(i):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    s = ""
+    while True:
+        i, r = divmod(i, 36)
+        s = digits[r] + s
+        if not i:
+            return s
+
+
+def create_prefectures(count):
+    """Prefectureをcount件作り直す (Userも削除する)"""
+    User.objects.all().delete()
+    Prefecture.objects.all().delete()
+    Prefecture.objects.bulk_create([
+        Prefecture(id=i, name="p" + _base36(i), capital="c%d" % i,
+                   is_od=i % 10 == 0, population=(i * 7919) % 10000000)
+        for i in range(1, count + 1)
+    ])
+
+
+def create_users(count, prefecture_count):
+    User.objects.all().delete()
+    User.objects.bulk_create([
+        User(id=i, shimei="s%d" % i, shimei_kana="k%d" % i, sex="MF"[i % 2],
+             birthdate=datetime.date(1950, 1, 1) + datetime.timedelta(days=i % 20000),
+             blood_type="A", prefecture_id=i % prefecture_count + 1)
+        for i in range(1, count + 1)
+    ])
+
+
+class DictPrefectureJSONAPI(PrefectureJSONAPI):
+    """辞書のリストを返すJSONAPI"""
+    items = ()
+
+    def get_items_for_request(self, request):
+        return self.items
+
+
+def _get_content(response):
+    if getattr(response, "streaming", False):
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+def measure(name, rows, repeat, func, setup=None, teardown=None):
+    """funcを1回実行してクエリ数を数え、repeat回の実行時間を計測する"""
+    def run():
+        if setup is not None:
+            setup()
+        start = default_timer()
+        response = func()
+        content = _get_content(response)
+        elapsed = default_timer() - start
+        if teardown is not None:
+            teardown()
+        if response.status_code not in (200, 202):
+            raise RuntimeError("%s returned %d: %r" % (name, response.status_code, content[:200]))
+        return elapsed, len(content)
+
+    with CaptureQueriesContext(connection) as queries:
+        elapsed, size = run()
+    timings = sorted(run()[0] for i in range(repeat))
+
+    median = timings[len(timings) // 2]
+    return {
+        "name": name,
+        "rows": rows,
+        "repeat": repeat,
+        "queries": len(queries.captured_queries),
+        "bytes": size,
+        "min": timings[0],
+        "median": median,
+        "mean": sum(timings) / len(timings),
+        "rows_per_sec": rows / median if median > 0 else None,
+    }
+
+
+def read_benchmarks(rows, repeat):
+    factory = RequestFactory()
+    dict_api = DictPrefectureJSONAPI()
+    prefecture_api = ModelPrefectureJSONAPI()
+    streaming_api = ModelPrefectureJSONAPI()
+    streaming_api.streaming = True
+    user_api = ModelUserJSONAPI()
+
+    create_prefectures(rows)
+    create_users(rows, rows)
+    dict_api.items = list(Prefecture.objects.values("id", "name", "capital", "is_od", "population"))
+
+    def get(api, **params):
+        return lambda: api.request_index(factory.get("/", params))
+
+    per_page = min(rows, 100)
+    last_page = max(1, rows // per_page)
+    results = [
+        measure("get_index_dict", rows, repeat, get(dict_api)),
+        measure("get_index", rows, repeat, get(prefecture_api)),
+        measure("get_index_streaming", rows, repeat, get(streaming_api)),
+        measure("get_index_users", rows, repeat, get(user_api)),
+        measure("get_index_fields", rows, repeat, get(prefecture_api, fields="id,name")),
+        measure("filter", rows, repeat, get(prefecture_api, population_gte=5000000)),
+        measure("sort", rows, repeat, get(prefecture_api, sort="-population")),
+        measure("page", per_page, repeat,
+                get(prefecture_api, per_page=per_page, page=last_page)),
+        measure("cursor", per_page, repeat,
+                get(prefecture_api, per_page=per_page, cursor="", sort="-population")),
+    ]
+    return results
+
+
+def write_benchmarks(repeat):
+    factory = RequestFactory()
+    create_prefectures(WRITE_ROWS)
+    offset = [WRITE_ROWS]
+
+    def post(api):
+        def func():
+            data = {"prefectures": [
+                {"name": "n" + _base36(offset[0] + i), "capital": "c", "population": i}
+                for i in range(POST_ITEMS)
+            ]}
+            offset[0] += POST_ITEMS
+            request = factory.post("/", data=json.dumps(data), content_type="application/json")
+            return api.request_index(request)
+        return func
+
+    def teardown():
+        Prefecture.objects.filter(id__gt=WRITE_ROWS).delete()
+
+    bulk_api = ModelPrefectureJSONAPI()
+    bulk_api.bulk_add = True
+
+    population = [0]
+
+    def put():
+        population[0] += 1
+        data = {"prefectures": {"id": 1, "capital": "c", "population": population[0]}}
+        request = factory.put("/", data=json.dumps(data), content_type="application/json")
+        return ModelPrefectureJSONAPI().request_item(request, "1")
+
+    return [
+        measure("post_index", POST_ITEMS, repeat, post(ModelPrefectureJSONAPI()), teardown=teardown),
+        measure("post_index_bulk", POST_ITEMS, repeat, post(bulk_api), teardown=teardown),
+        measure("put_item", 1, repeat, put),
+    ]
+
+
+def run_benchmarks(rows_list, repeat):
+    # DEBUGでは実行したクエリがメタデータとしてレスポンスに含まれるため無効にする
+    with override_settings(DEBUG=False):
+        results = []
+        for rows in rows_list:
+            results.extend(read_benchmarks(rows, repeat))
+        results.extend(write_benchmarks(repeat))
+    encoder = get_encoder(jsonapi.JSONAPI.json_encoder)
+    return {
+        "date": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "json_encoder": [name for name, dumps in ENCODERS.items() if dumps is encoder][0],
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Benchmark JSONAPI serialization and CRUD on a temporary test database "
+            "and optionally save the results as JSON.")
+
+    if django.VERSION < (1, 8):
+        option_list = BaseCommand.option_list + (
+            make_option("--rows", default=DEFAULT_ROWS,
+                        help="Comma separated row counts for index benchmarks"),
+            make_option("--repeat", type="int", default=DEFAULT_REPEAT,
+                        help="Number of timed runs per benchmark"),
+            make_option("--output", default=None, help="Write the results to this JSON file"),
+            make_option("--compare", default=None, help="Compare with a previous JSON result"),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", default=DEFAULT_ROWS,
+                            help="Comma separated row counts for index benchmarks")
+        parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                            help="Number of timed runs per benchmark")
+        parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+        parser.add_argument("--compare", default=None, help="Compare with a previous JSON result")
+
+    def handle(self, *args, **options):
+        rows_list = [int(rows) for rows in options["rows"].split(",") if rows.strip()]
+        repeat = int(options["repeat"])
+
+        # 開発用のデータベースを書き換えないようにテスト用のデータベースで計測する
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = run_benchmarks(rows_list, repeat)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        baseline = {}
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                for result in json.load(f)["results"]:
+                    baseline[(result["name"], result["rows"])] = result
+        self.print_results(report["results"], baseline)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write("Saved to %s" % options["output"])
+
+    def print_results(self, results, baseline):
+        self.stdout.write("%-20s %8s %8s %12s %14s %s" %
+                          ("name", "rows", "queries", "median(ms)", "rows/sec", "vs baseline"))
+        for result in results:
+            line = "%-20s %8d %8d %12.3f %14.0f" % (
+                result["name"], result["rows"], result["queries"],
+                result["median"] * 1000, result["rows_per_sec"] or 0)
+            base = baseline.get((result["name"], result["rows"]))
+            if base is not None and base["median"] > 0:
+                line += " %+.1f%%" % ((result["median"] / base["median"] - 1) * 100)
+            self.stdout.write(line)
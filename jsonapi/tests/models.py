@@ -25,3 +25,28 @@ class User(models.Model):
     mobile = models.CharField("携帯番号", max_length=12, blank=True)
     carrier = models.ForeignKey(Carrier, blank=True, null=True)
 
+
+class Memo(models.Model):
+    text = models.CharField("本文", max_length=100)
+    is_done = models.BooleanField("完了", default=False, blank=True)
+    version = models.IntegerField("版", default=0)
+    updated_at = models.DateTimeField("更新日時", auto_now=True)
+
+class VersionedMemo(Memo):
+    """保存するたびに版を上げる"""
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        Memo.save(self, *args, **kwargs)
+
+
+class RevisedNote(models.Model):
+    """保存するたびに版を上げる (プロキシでないモデル)"""
+    text = models.CharField("本文", max_length=100)
+    version = models.IntegerField("版", default=0)
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        models.Model.save(self, *args, **kwargs)
@@ -23,6 +23,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = (
+    "jsonapi",
     "jsonapi.tests",
 )
 
@@ -37,6 +38,9 @@ SITE_ID = 1
 # urls attribute, it does not need to be populated.
 ROOT_URLCONF = 'jsonapi.tests.urls'
 
+# テスト用のモデルには索引の提案を確認するために索引を定義していない
+SILENCED_SYSTEM_CHECKS = ["jsonapi.W001"]
+
 WSGI_APPLICATION = 'jsonapi.tests.wsgi.application'
 
 # Database
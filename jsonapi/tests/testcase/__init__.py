@@ -1,9 +1,12 @@
 # encoding=utf-8
 
+import contextlib
 import datetime
+import decimal
 import json
 from django.test import TestCase
 from django.test.client import Client
+import jsonapi
 
 class JST(datetime.tzinfo):
     def utcoffset(self, dt):
@@ -14,6 +17,13 @@ class JST(datetime.tzinfo):
         return 'JST'
 
 
+def run_on_commit(test):
+    """ブロック内で登録したon_commitのコールバックをブロックの終わりで実行する"""
+    if hasattr(test, "captureOnCommitCallbacks"):
+        return test.captureOnCommitCallbacks(execute=True)
+    return contextlib.nullcontext()  # Django < 3.2 (on_commitがない場合はすぐに実行される)
+
+
 class JSONAPITest(TestCase):
 
     def setUp(self):
@@ -34,6 +44,46 @@ class JSONAPITest(TestCase):
         self.assertEqual(self.api.json_serialize(dt), "2014-09-20T15:02:04+09:00", "Invalid serialize of `datetime.date` type.")
 
 
+    def test_decimal(self):
+        d = decimal.Decimal("1.10")
+        self.assertEqual(self.api.json_serialize(d), "1.10", "Invalid serialize of `decimal.Decimal` type.")
+
+    def test_json_encoders(self):
+        """利用できる全てのエンコーダで同じ結果になる"""
+        from collections import OrderedDict
+        from django.utils.safestring import mark_safe
+        from jsonapi.encoders import ENCODERS
+
+        class Kind(str):
+            pass
+
+        class Rank(int):
+            pass
+
+        data = {"date": datetime.date(2014, 10, 12),
+                "datetime": datetime.datetime(2014, 9, 20, 15, 2, 4, 5).replace(tzinfo=JST()),
+                "name": "東京都/新宿区",
+                "price": decimal.Decimal("1.10"),
+                "safe": mark_safe("<b>都庁</b>"),
+                "kind": Kind("city"),
+                "rank": Rank(1),
+                "items": [OrderedDict([("id", 1), ("price", decimal.Decimal("0.5"))])]}
+        expected = {"date": "2014-10-12",
+                    "datetime": "2014-09-20T15:02:04.000005+09:00",
+                    "name": "東京都/新宿区",
+                    "price": "1.10",
+                    "safe": "<b>都庁</b>",
+                    "kind": "city",
+                    "rank": 1,
+                    "items": [{"id": 1, "price": "0.5"}]}
+        for name, encoder in ENCODERS.items():
+            if encoder is None:
+                continue
+            self.api.json_encoder = name
+            content = self.api.json_dumps(data)
+            self.assertTrue(isinstance(content, bytes))
+            self.assertEqual(json.loads(content.decode("utf-8")), expected, name)
+
     def test_get_index(self):
         response = self.client.get("/prefectures/")
         self.assertEqual(response.status_code, 200, "Status Code is not 200")
@@ -68,6 +118,24 @@ class JSONAPITest(TestCase):
             self.assertEqual(prefecture[field], original_prefecture[field])
 
 
+    def test_get_index_fields(self):
+        """fieldsパラメータで指定した属性だけを返す"""
+        response = self.client.get("/prefectures/", {"fields": "name,id"})
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(response["prefectures"]), 47)
+        self.assertEqual(response["prefectures"][0], {"id": 1, "name": "北海道"})
+
+        response = self.client.get("/prefectures/27/", {"fields": "is_designated_by_ordinance"})
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(response["prefectures"], {"is_designated_by_ordinance": True})
+
+    def test_get_index_fields_invalid(self):
+        """宣言されていない属性は 400 BadRequest"""
+        response = self.client.get("/prefectures/", {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
     def test_get_item_notfound(self):
         """存在しないIDのため 404 NotFound"""
         id = 100
@@ -201,8 +269,26 @@ class JSONAPITest(TestCase):
         self.assertEqual(response[0], {})
         self.assertTrue("population" in response[1])
 
+    def test_validation_errors_encoders(self):
+        """どのエンコーダでもバリデーションエラーのメッセージを返す"""
+        from django.test.client import RequestFactory
+        from jsonapi.encoders import ENCODERS
+        data = {"prefectures": [{"name": "架空県", "capital": "架空市"}]}
+        for name, encoder in ENCODERS.items():
+            if encoder is None:
+                continue
+            self.api.json_encoder = name
+            request = RequestFactory().post("/prefectures/", data=json.dumps(data), content_type="application/json")
+            response = self.api.request_index(request)
+            self.assertEqual(response.status_code, 400, "Status Code is not 400")
+            errors = json.loads(response.content.decode("utf-8"))
+            self.assertEqual(len(errors[0]["population"]), 1, name)
+            self.assertTrue(errors[0]["population"][0], name)
+        self.api.json_encoder = "json"
+
     def test_post_item(self):
         """対応しないリクエストのため 405 NotAllowed"""
+        id = 27
         response = self.client.post("/prefectures/{0}/".format(id))
         self.assertEqual(response.status_code, 405, "Status Code is not 405")
 
@@ -315,3 +401,362 @@ class JSONAPITest(TestCase):
         self.assertEqual(response["meta"], metadata)
 
 
+    def test_item_to_dict_object(self):
+        """属性を持つオブジェクトのシリアライズ"""
+        class Item(object):
+            def __init__(self, id, name):
+                self.id = id
+                self.name = name
+            def upper_name(self):
+                return self.name.upper()
+
+        class ItemJSONAPI(jsonapi.JSONAPI):
+            fields = ("id", ("name", "upper_name"), ("parent_name", "parent__name"))
+
+        api = ItemJSONAPI()
+        item = Item(1, "foo")
+        item.parent = {"name": "bar"}
+        for i in range(2):
+            # 2回目以降はコンパイル済みの参照方法を用いる
+            self.assertEqual(api._item_to_dict(item), {"id": 1, "name": "FOO", "parent_name": "bar"})
+
+        # 辞書が混在しても同じ結果になる
+        self.assertEqual(api._item_to_dict({"id": 2, "upper_name": "BAZ", "parent": item}),
+                         {"id": 2, "name": "BAZ", "parent_name": "foo"})
+
+    def test_item_to_dict_property_error(self):
+        """プロパティで発生した例外は添字での参照に置き換えずに送出する"""
+        calls = []
+
+        class Item(object):
+            def __init__(self, id):
+                self.id = id
+            @property
+            def name(self):
+                calls.append(self.id)
+                if self.id == 2:
+                    raise TypeError("broken")
+                if self.id == 3:
+                    raise AttributeError("broken")
+                return "item%d" % self.id
+
+        class ItemJSONAPI(jsonapi.JSONAPI):
+            fields = ("id", "name")
+
+        api = ItemJSONAPI()
+        self.assertEqual(api._item_to_dict(Item(1)), {"id": 1, "name": "item1"})
+        for id, error in ((2, TypeError), (3, AttributeError)):
+            del calls[:]
+            with self.assertRaises(error) as context:
+                api._item_to_dict(Item(id))
+            self.assertEqual(str(context.exception), "broken")
+            # 1回だけ評価する
+            self.assertEqual(calls, [id])
+        self.assertRaises(AttributeError, ItemJSONAPI()._getattr, Item(3), "name")
+
+    def test_field_plan_cache(self):
+        """fieldsのコンパイル結果はクラスごとに再利用される"""
+        plan = self.api._get_field_plan()
+        self.assertTrue(plan is self.api._get_field_plan())
+        self.assertEqual([accessor.name for accessor in plan],
+                         ["id", "name", "capital", "is_od", "population", "is_designated_by_ordinance"])
+
+        # fields=パラメータの組み合わせごとに増え続けない
+        class SmallCacheJSONAPI(type(self.api)):
+            class_cache_size = 2
+        api = SmallCacheJSONAPI()
+        plan = api._get_field_plan()
+        api._get_field_plan(("id",))
+        self.assertTrue(plan is api._get_field_plan())
+        api._get_field_plan(("name",))
+        self.assertEqual(len(api._get_class_cache("_field_plans")), 2)
+        self.assertTrue(plan is api._get_field_plan())
+        self.assertFalse(("id",) in api._get_class_cache("_field_plans"))
+
+    def test_get_index_streaming(self):
+        """ストリーミングによる一覧の取得"""
+        from django.test.client import RequestFactory
+        api = self.api
+        api.streaming = True
+        api.stream_chunk_size = 10
+
+        response = api.get_index(RequestFactory().get("/prefectures/"))
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        response = json.loads(content.decode("utf-8"))
+
+        expected = json.loads(self.client.get("/prefectures/").content.decode("utf-8"))
+        self.assertEqual(response["prefectures"], expected["prefectures"])
+        self.assertEqual(len(response["prefectures"]), 47)
+
+    def test_get_item_by_id_index(self):
+        """idの索引による取得"""
+        data = [{"id": i, "name": "item%d" % i} for i in range(1, 101)]
+
+        class IndexedJSONAPI(jsonapi.JSONAPI):
+            id_index = True
+            version = 1
+            def get_items_for_request(self, request):
+                return data
+            def get_items_version(self, request):
+                return self.version
+
+        api = IndexedJSONAPI()
+        self.assertEqual(api.get_item_by_id(None, "27"), data[26])
+        self.assertEqual(api.get_item_by_id(None, "101"), None)
+        index = api._id_index
+        api.get_item_by_id(None, "1")
+        self.assertTrue(api._id_index is index)
+
+        # データの追加
+        data.append({"id": 101, "name": "item101"})
+        self.assertEqual(api.get_item_by_id(None, "101"), data[100])
+
+        # バージョンの変更
+        data[0] = {"id": 1, "name": "changed"}
+        api.version = 2
+        self.assertEqual(api.get_item_by_id(None, "1")["name"], "changed")
+
+        # 変更の通知
+        data[1] = {"id": 2, "name": "changed"}
+        api.items_changed()
+        self.assertEqual(api.get_item_by_id(None, "2")["name"], "changed")
+
+    def test_post_index_too_large(self):
+        """リクエストボディが大きすぎるため 413"""
+        from django.test.client import RequestFactory
+        pref_data = {"name": "架空県", "capital": "架空市", "is_od": True, "population": 100}
+        body = json.dumps({"prefectures": [pref_data] * 3})
+        request = RequestFactory().post("/prefectures/", data=body, content_type="application/json")
+
+        self.api.max_body_size = len(body) - 1
+        self.assertEqual(self.api.post_index(request).status_code, 413)
+
+        self.api.max_body_size = len(body)
+        self.api.max_items = 2
+        self.assertEqual(self.api.post_index(request).status_code, 413)
+
+        self.api.max_items = 3
+        self.assertEqual(self.api.post_index(request).status_code, 200)
+
+    def test_json_decoders(self):
+        """利用できる全てのデコーダでバイト列を読み込める"""
+        from django.test.client import RequestFactory
+        body = json.dumps({"prefectures": {"name": "架空県"}}, ensure_ascii=False).encode("utf-8")
+        request = RequestFactory().post("/prefectures/", data=body, content_type="application/json")
+        invalid_request = RequestFactory().post("/prefectures/", data=b"{", content_type="application/json")
+
+        from jsonapi.encoders import DECODERS
+        for name, decoder in DECODERS.items():
+            if decoder is None:
+                continue
+            self.api.json_decoder = name
+            self.assertEqual(self.api._get_json_payload(request), {"prefectures": {"name": "架空県"}}, name)
+            self.assertEqual(self.api._get_json_payload(invalid_request), None, name)
+
+    def test_put_index(self):
+        """複数のItemの変更"""
+        from django.test.client import RequestFactory
+        pref_data = [{"id": id, "name": "架空%d県" % id, "capital": "架空市", "is_od": False, "population": 100}
+                     for id in (1, 27)]
+        request = RequestFactory().put("/prefectures/", data=json.dumps({"prefectures": pref_data}),
+                                       content_type="application/json")
+        self.assertEqual(self.api.request_index(request).status_code, 405)
+
+        self.api.allow_bulk_change = True
+        response = self.api.request_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        for pref in pref_data:
+            pref["is_designated_by_ordinance"] = pref["is_od"]
+        self.assertEqual(response["prefectures"], pref_data)
+
+    def test_put_index_invalid(self):
+        """エラーはItemごとに返す"""
+        from django.test.client import RequestFactory
+        self.api.allow_bulk_change = True
+        pref_data = [{"id": 1, "name": "架空県", "capital": "架空市", "is_od": False, "population": 100},
+                     {"id": 2, "name": "架空県", "capital": "架空市", "is_od": False, "population": "deadbeaf"},
+                     {"id": 100, "name": "架空県", "capital": "架空市", "is_od": False, "population": 100}]
+        request = RequestFactory().patch("/prefectures/", data=json.dumps({"prefectures": pref_data}),
+                                         content_type="application/json")
+        response = self.api.request_index(request)
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(response), 3)
+        self.assertEqual(response[0], {})
+        self.assertTrue("population" in response[1])
+        self.assertTrue("id" in response[2])
+
+    def test_delete_index(self):
+        """複数のItemの削除"""
+        from django.test.client import RequestFactory
+        request = RequestFactory().delete("/prefectures/", data=json.dumps({"prefectures": [1, 27, 100]}),
+                                          content_type="application/json")
+        self.assertEqual(self.api.request_index(request).status_code, 405)
+
+        self.api.allow_bulk_delete = True
+        response = self.api.request_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["deleted"], 2)
+
+        request = RequestFactory().delete("/prefectures/")
+        self.assertEqual(self.api.request_index(request).status_code, 400)
+
+    def test_cache(self):
+        """GETのレスポンスのキャッシュ"""
+        from django.test.client import RequestFactory
+        data = [{"id": 1, "name": "item1"}]
+
+        class CachedJSONAPI(jsonapi.JSONAPI):
+            model_name = "cached_items"
+            fields = ("id", "name")
+            cache_timeout = 60
+            def get_items_for_request(self, request):
+                return data
+
+        api = CachedJSONAPI()
+        api._get_cache().clear()
+        factory = RequestFactory()
+
+        response = api.request_index(factory.get("/cached_items/", {"a": "1"}))
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        # キャッシュしたレスポンスを返す
+        data[0] = {"id": 1, "name": "changed"}
+        response = api.request_index(factory.get("/cached_items/", {"a": "1"}))
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["cached_items"][0]["name"], "item1")
+        self.assertEqual(response["ETag"], etag)
+
+        # パラメータが異なる
+        response = api.request_index(factory.get("/cached_items/", {"a": "2"}))
+        self.assertNotEqual(response["ETag"], etag)
+
+        # 条件付きリクエスト
+        response = api.request_index(factory.get("/cached_items/", {"a": "1"}, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304, "Status Code is not 304")
+        self.assertEqual(response.content, b"")
+        response = api.request_item(factory.get("/cached_items/1/", HTTP_IF_NONE_MATCH=etag), "1")
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+
+        # 変更の通知でキャッシュを無効にする
+        with run_on_commit(self):
+            api.items_changed()
+        response = api.request_index(factory.get("/cached_items/", {"a": "1"}, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["cached_items"][0]["name"], "changed")
+
+        # 同じmodel_nameのAPIとはキャッシュを共有しない
+        class OtherCachedJSONAPI(CachedJSONAPI):
+            def get_items_for_request(self, request):
+                return [{"id": 2, "name": "other"}]
+
+        other = OtherCachedJSONAPI()
+        self.assertNotEqual(other.get_cache_prefix(), api.get_cache_prefix())
+        response = other.request_index(factory.get("/cached_items/", {"a": "1"}))
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["cached_items"][0]["name"], "other")
+        self.assertNotEqual(response["ETag"], etag)
+
+        other.cache_prefix = "items"
+        self.assertEqual(other.get_cache_prefix(), "items")
+        self.assertEqual(other.get_cache_key(factory.get("/cached_items/"), "1"), "items:1:[]")
+
+    def test_row_cache(self):
+        """行ごとのJSONのキャッシュ"""
+        from django.test.client import RequestFactory
+        calls = []
+
+        class Item(object):
+            def __init__(self, id, updated_at):
+                self.id = id
+                self.updated_at = updated_at
+            def expensive(self):
+                calls.append(self.id)
+                return self.id * 2
+
+        data = [Item(i, 1) for i in range(1, 11)]
+
+        class RowCachedJSONAPI(jsonapi.JSONAPI):
+            model_name = "row_cached_items"
+            fields = ("id", "expensive")
+            row_cache_timeout = 60
+            row_version_field = "updated_at"
+            stream_chunk_size = 3
+            def get_items_for_request(self, request):
+                return data
+
+        api = RowCachedJSONAPI()
+        api._get_cache().clear()
+        request = RequestFactory().get("/row_cached_items/")
+        expected = [{"id": i, "expensive": i * 2} for i in range(1, 11)]
+
+        response = api.get_index(request)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["row_cached_items"], expected)
+        self.assertEqual(len(calls), 10)
+
+        # 全ての行をキャッシュから返す
+        del calls[:]
+        response = api.get_index(request)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["row_cached_items"], expected)
+        self.assertEqual(calls, [])
+
+        # バージョンが変わった行だけシリアライズする
+        data[4].updated_at = 2
+        response = api.get_index(request)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["row_cached_items"], expected)
+        self.assertEqual(calls, [5])
+
+        # 同じmodel_nameとfieldsのAPIとは行のキャッシュを共有しない
+        class NegativeRowCachedJSONAPI(RowCachedJSONAPI):
+            def _item_to_dict(self, item, plan=None):
+                return {"id": item.id, "expensive": -item.id}
+
+        del calls[:]
+        response = NegativeRowCachedJSONAPI().get_index(request)
+        self.assertEqual([row["expensive"] for row in json.loads(response.content.decode("utf-8"))["row_cached_items"]],
+                         [-i for i in range(1, 11)])
+
+        # row_version_fieldがない場合はitems_changedで無効にする
+        api.row_version_field = None
+        api.get_index(request)
+        del calls[:]
+        api.get_index(request)
+        self.assertEqual(calls, [])
+        with run_on_commit(self):
+            api.items_changed()
+        api.get_index(request)
+        self.assertEqual(len(calls), 10)
+
+    def test_instrumentation(self):
+        """処理ごとの計測結果をServer-TimingヘッダとObserverで受け取る"""
+        from django.test.client import RequestFactory
+        from jsonapi.instrumentation import Observer
+        from jsonapi.tests.views import PrefectureJSONAPI
+
+        class RecordingObserver(Observer):
+            def __init__(self):
+                self.records = []
+            def request_finished(self, api, request, context, response):
+                self.records.append((dict(context.timings), dict(context.stats)))
+
+        observer = RecordingObserver()
+        api = PrefectureJSONAPI()
+        api.observers = (observer,)
+        api.server_timing = True
+        response = api.request_index(RequestFactory().get("/prefectures/"))
+        self.assertEqual(response.status_code, 200)
+
+        metrics = [metric.split(";")[0] for metric in response["Server-Timing"].split(", ")]
+        self.assertEqual(metrics, ["query", "serialize", "encode", "db", "total"])
+        timings, stats = observer.records[0]
+        self.assertTrue(timings["total"] >= timings["serialize"])
+        self.assertEqual(stats["rows"], 47)
+        self.assertEqual(stats["queries"], 0)
+        self.assertEqual(stats["bytes"], len(response.content))
+
+        # 計測しない場合はヘッダを付けない
+        response = PrefectureJSONAPI().request_index(RequestFactory().get("/prefectures/"))
+        self.assertFalse(response.has_header("Server-Timing"))
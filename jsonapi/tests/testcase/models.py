@@ -2,10 +2,13 @@
 
 import datetime
 import json
+from unittest import skipIf
+import django
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.client import Client
 from jsonapi.tests.models import Prefecture
-from jsonapi.tests.testcase import JST
+from jsonapi.tests.testcase import JST, run_on_commit
 
 class ModelJSONAPITest(TestCase):
     fixtures = ['prefecture.json', 'carrier.json', 'user.json']
@@ -21,6 +24,18 @@ class ModelJSONAPITest(TestCase):
         pref = Prefecture.objects.get(id=id)
         self.assertEqual(self.prefecture_api.json_serialize(pref), id)
 
+    def test_json_encoder(self):
+        """モデルはエンコーダによらず`id`に変換する"""
+        from jsonapi.encoders import ENCODERS
+        pref = Prefecture.objects.get(id=27)
+        for name, encoder in ENCODERS.items():
+            if encoder is None:
+                continue
+            self.prefecture_api.json_encoder = name
+            content = self.prefecture_api.json_dumps({"prefecture": pref})
+            self.assertEqual(json.loads(content.decode("utf-8")), {"prefecture": 27}, name)
+        self.prefecture_api.json_encoder = "json"
+
     def test_date(self):
         d = datetime.date(2014, 10, 12)
         self.assertEqual(self.prefecture_api.json_serialize(d), "2014-10-12", "Invalid serialize of `datetime.date` type.")
@@ -175,6 +190,49 @@ class ModelJSONAPITest(TestCase):
 
         self.assertEqual(len(response["prefectures"]), 3)
 
+    def test_filter_lookups(self):
+        """フィルタの値をフィールドの型に変換し、ルックアップを追加する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI, ModelUserJSONAPI
+
+        class PrefectureLookupJSONAPI(ModelPrefectureJSONAPI):
+            filters = (("id", "id", ("in", "range")), ("od", "is_od"),
+                       ("population", "population", ("gte", "lt")))
+        api = PrefectureLookupJSONAPI()
+
+        def get(api, params, name):
+            response = api.get_index(RequestFactory().get("/", params))
+            self.assertEqual(response.status_code, 200, "Status Code is not 200")
+            return [item["id"] for item in json.loads(response.content.decode("utf-8"))[name]]
+
+        self.assertEqual(sorted(get(api, {"id__in": "13, 27,1"}, "prefectures")), [1, 13, 27])
+        self.assertEqual(sorted(get(api, {"id__range": "3,5"}, "prefectures")), [3, 4, 5])
+        self.assertEqual(len(get(api, {"od": "true"}, "prefectures")),
+                         Prefecture.objects.filter(is_od=True).count())
+        self.assertEqual(len(get(api, {"od": "0"}, "prefectures")),
+                         Prefecture.objects.filter(is_od=False).count())
+        self.assertEqual(len(get(api, {"population__gte": "5000000", "population__lt": "8856000"},
+                                 "prefectures")),
+                         Prefecture.objects.filter(population__gte=5000000,
+                                                   population__lt=8856000).count())
+        # 未知のパラメータは無視する
+        self.assertEqual(len(get(api, {"population__lte": "x", "unknown": "1"}, "prefectures")), 47)
+
+        for params in ({"id__in": "1,x"}, {"id__range": "1"}, {"od": "maybe"}, {"population": "many"}):
+            response = api.get_index(RequestFactory().get("/", params))
+            self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
+        class UserLookupJSONAPI(ModelUserJSONAPI):
+            filters = (("prefecture", "prefecture", ("in",)), ("born_after", "birthdate__gte"))
+        api = UserLookupJSONAPI()
+        from jsonapi.tests.models import User
+        self.assertEqual(len(get(api, {"prefecture__in": "13,27"}, "users")),
+                         User.objects.filter(prefecture__in=[13, 27]).count())
+        self.assertEqual(len(get(api, {"born_after": "1980-01-01"}, "users")),
+                         User.objects.filter(birthdate__gte=datetime.date(1980, 1, 1)).count())
+        response = api.get_index(RequestFactory().get("/", {"born_after": "1980-13-01"}))
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
 
     def test_order_asc(self):
         """昇順ソート"""
@@ -269,5 +327,1185 @@ class ModelJSONAPITest(TestCase):
         self.assertEqual(response["meta"]["per_page"], per_page)
         self.assertEqual(response["meta"]["page"], 1)
 
+    def test_get_index_streaming(self):
+        """ストリーミングによる一覧の取得"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.streaming = True
+        api.stream_chunk_size = 2
+
+        request = RequestFactory().get("/models/prefectures/", {"per_page": 5, "page": 3})
+        response = api.get_index(request)
+        self.assertTrue(response.streaming)
+        response = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], [11, 12, 13, 14, 15])
+        self.assertEqual(response["meta"]["total"], 47)
+        self.assertEqual(response["meta"]["page"], 3)
+
+    def test_value_columns(self):
+        """values_list()で取得するカラム"""
+        from jsonapi.tests.views import ModelUserJSONAPI
+        self.assertEqual(self.prefecture_api._get_value_columns(),
+                         ("id", "name", "capital", "is_od", "population", "is_od"))
+
+        class SexUserJSONAPI(ModelUserJSONAPI):
+            fields = ("id", ("sex", "get_sex_display"))
+        self.assertEqual(SexUserJSONAPI()._get_value_columns(), None)
+
+    def test_get_index_values(self):
+        """values_list()による取得とインスタンスからの取得が一致する"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelUserJSONAPI
+        settings.DEBUG = False
+        response = self.client.get("/models/users/")
+        self.assertEqual(response.status_code, 200)
+        response = json.loads(response.content.decode("utf-8"))
+
+        api = ModelUserJSONAPI()
+        api.fetch_values = False
+        expected = json.loads(api.get_index(RequestFactory().get("/models/users/")).content.decode("utf-8"))
+
+        self.assertEqual(len(response["users"]), 100)
+        self.assertEqual(response, expected)
+        self.assertEqual(response["users"][0]["prefecture"], 15)
+        self.assertEqual(response["users"][0]["prefecture_name"], "新潟県")
+        self.assertEqual(response["users"][0]["birthdate"], "1917-12-14")
+
+    def test_fetch_values_overridden(self):
+        """シリアライズのメソッドをオーバーライドした場合はvalues_list()を用いない"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelUserJSONAPI
+
+        class PrefectureNameJSONAPI(ModelUserJSONAPI):
+            fields = ("id", "prefecture")
+            def json_serialize(self, obj):
+                if isinstance(obj, Prefecture):
+                    return obj.name
+                return super(PrefectureNameJSONAPI, self).json_serialize(obj)
+
+        class LowerBloodTypeJSONAPI(ModelUserJSONAPI):
+            fields = ("id", "blood_type")
+            def _item_to_dict(self, item, plan=None):
+                d = super(LowerBloodTypeJSONAPI, self)._item_to_dict(item, plan)
+                d["blood_type"] = d["blood_type"].lower()
+                return d
+
+        request = RequestFactory().get("/models/users/", {"per_page": 1})
+        response = json.loads(PrefectureNameJSONAPI().get_index(request).content.decode("utf-8"))
+        self.assertEqual(response["users"][0]["prefecture"], "新潟県")
+        response = json.loads(LowerBloodTypeJSONAPI().get_index(request).content.decode("utf-8"))
+        self.assertTrue(response["users"][0]["blood_type"] in ("a", "b", "o", "ab"))
+        self.assertFalse(ModelUserJSONAPI()._serializer_overridden)
+
+    def test_related_lookups(self):
+        """fieldsとfiltersからselect_related/prefetch_relatedを推定する"""
+        from jsonapi.tests.views import ModelUserJSONAPI, ModelPrefectureJSONAPI
+        api = ModelUserJSONAPI()
+        self.assertEqual(api._select_related_lookups, ("prefecture", "carrier"))
+        self.assertEqual(api._prefetch_related_lookups, ())
+        self.assertEqual(self.prefecture_api._select_related_lookups, ())
+
+        class UserFilterJSONAPI(ModelUserJSONAPI):
+            fields = ("id",)
+            filters = ("prefecture", ("prefecture_name", "prefecture__name"), ("od", "prefecture__is_od"))
+        self.assertEqual(UserFilterJSONAPI()._select_related_lookups, ("prefecture",))
+
+        class PrefectureUsersJSONAPI(ModelPrefectureJSONAPI):
+            fields = ("id", ("users", "user_set__count"))
+        api = PrefectureUsersJSONAPI()
+        self.assertEqual(api._prefetch_related_lookups, ("user_set",))
+
+        class OverrideUserJSONAPI(ModelUserJSONAPI):
+            select_related = ("prefecture",)
+            prefetch_related = ()
+        api = OverrideUserJSONAPI()
+        self.assertEqual(api._select_related_lookups, ("prefecture",))
+
+    def test_related_lookups_queries(self):
+        """関連オブジェクトの読み込みでクエリ数が増えない"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelUserJSONAPI, ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        request = RequestFactory().get("/")
+
+        api = ModelUserJSONAPI()
+        api.fetch_values = False
+        with self.assertNumQueries(1):
+            response = api.get_index(request)
+        self.assertEqual(len(json.loads(response.content.decode("utf-8"))["users"]), 100)
+
+        class PrefectureUsersJSONAPI(ModelPrefectureJSONAPI):
+            fields = ("id", ("users", "user_set__count"))
+        with self.assertNumQueries(2):
+            response = PrefectureUsersJSONAPI().get_index(request)
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(sum(pref["users"] for pref in response["prefectures"]), 100)
+
+    def _get_cursor_pages(self, params, cursor_key="next", cursor=""):
+        ids = []
+        while cursor is not None:
+            query = dict(params, cursor=cursor)
+            response = self.client.get("/models/prefectures/", query)
+            self.assertEqual(response.status_code, 200, "Status Code is not 200")
+            response = json.loads(response.content.decode("utf-8"))
+            self.assertFalse("total" in response["meta"])
+            ids.append([pref["id"] for pref in response["prefectures"]])
+            cursor = response["meta"][cursor_key]
+        return ids
+
+    def test_cursor_pagenation(self):
+        """カーソルによるページネーション"""
+        pages = self._get_cursor_pages({"per_page": 10})
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 10, 7])
+        self.assertEqual(sum(pages, []), list(range(1, 48)))
+
+    def test_cursor_pagenation_order(self):
+        """同じ値を含むフィールドでのソート"""
+        for sort, field in (("od", "is_od"), ("-od", "-is_od"), ("-population", "-population")):
+            pages = self._get_cursor_pages({"per_page": 6, "sort": sort})
+            ids = sum(pages, [])
+            expected = list(Prefecture.objects.order_by(field, "pk").values_list("pk", flat=True))
+            self.assertEqual(ids, expected)
+
+    def test_cursor_pagenation_prev(self):
+        """前のページへの移動"""
+        params = {"per_page": 10, "sort": "-od"}
+        response = self.client.get("/models/prefectures/", dict(params, cursor=""))
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(response["meta"]["prev"], None)
+        first_page = [pref["id"] for pref in response["prefectures"]]
+
+        response = self.client.get("/models/prefectures/", dict(params, cursor=response["meta"]["next"]))
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertNotEqual(response["meta"]["prev"], None)
+
+        response = self.client.get("/models/prefectures/", dict(params, cursor=response["meta"]["prev"]))
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], first_page)
+        self.assertEqual(response["meta"]["prev"], None)
+
+    def test_cursor_pagenation_invalid_cursor(self):
+        """不正なカーソルは先頭ページとする"""
+        response = self.client.get("/models/prefectures/", {"per_page": 5, "cursor": "deadbeaf"})
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], [1, 2, 3, 4, 5])
+
+        # フィールドの型に変換できない値
+        import base64
+        first = self.client.get("/models/prefectures/", {"per_page": 5, "sort": "population"})
+        first = json.loads(first.content.decode("utf-8"))
+        for values in (["abc", 1], [{"a": 1}], [{"a": 1}, 1], [[1], 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(["n", values]).encode("utf-8")).decode("ascii")
+            response = self.client.get("/models/prefectures/",
+                                       {"per_page": 5, "sort": "population", "cursor": cursor})
+            self.assertEqual(response.status_code, 200, "Status Code is not 200")
+            response = json.loads(response.content.decode("utf-8"))
+            self.assertEqual(response["prefectures"], first["prefectures"])
+
+    def test_post_index_bulk(self):
+        """まとめて追加する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        api = ModelPrefectureJSONAPI()
+        api.bulk_add = True
+        api.bulk_batch_size = 2
+        items = [{"name": "架空%d県" % i, "capital": "架空市", "is_od": False, "population": i}
+                 for i in range(5)]
+        request = RequestFactory().post("/models/prefectures/", data=json.dumps({"prefectures": items}),
+                                        content_type="application/json")
+        response = api.post_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], [48, 49, 50, 51, 52])
+        self.assertEqual(Prefecture.objects.count(), 52)
+        self.assertEqual(Prefecture.objects.get(id=52).name, "架空4県")
+
+    def test_can_bulk_create(self):
+        """シグナルがある場合はbulk_createを用いない"""
+        from django.db import connection
+        from django.db.models.signals import post_save
+        features = connection.features
+        can_return = (getattr(features, "can_return_rows_from_bulk_insert", False) or
+                      getattr(features, "can_return_ids_from_bulk_insert", False))
+        self.assertEqual(self.prefecture_api._can_bulk_create(), bool(can_return))
+
+        def receiver(**kwargs):
+            pass
+        post_save.connect(receiver, sender=Prefecture)
+        try:
+            self.assertFalse(self.prefecture_api._can_bulk_create())
+        finally:
+            post_save.disconnect(receiver, sender=Prefecture)
+
+    def test_post_index_bulk_save(self):
+        """save()をオーバーライドしたモデルはbulk_addでも1件ずつsave()する"""
+        from django import forms
+        from django.test.client import RequestFactory
+        from jsonapi.models import ModelJSONAPI
+        from jsonapi.tests.models import RevisedNote
+
+        class NoteForm(forms.ModelForm):
+            class Meta:
+                model = RevisedNote
+                fields = ("text",)
+
+        class NoteJSONAPI(ModelJSONAPI):
+            model = RevisedNote
+            model_name = "notes"
+            fields = ("id", "text", "version")
+            add_form = NoteForm
+            bulk_add = True
+
+        api = NoteJSONAPI()
+        self.assertFalse(api._can_bulk_create())
+        request = RequestFactory().post("/notes/", data=json.dumps({"notes": [{"text": "a"}, {"text": "b"}]}),
+                                        content_type="application/json")
+        response = api.post_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual([note["version"] for note in json.loads(response.content.decode("utf-8"))["notes"]],
+                         [1, 1])
+        self.assertEqual(list(RevisedNote.objects.values_list("version", flat=True)), [1, 1])
+
+    def test_put_index(self):
+        """複数のItemをまとめて変更する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        api = ModelPrefectureJSONAPI()
+        api.allow_bulk_change = True
+        original = Prefecture.objects.get(id=13)
+        pref_data = [{"id": 13, "capital": original.capital, "population": 1},
+                     {"id": 27, "capital": "架空市", "population": 2}]
+        request = RequestFactory().put("/models/prefectures/", data=json.dumps({"prefectures": pref_data}),
+                                       content_type="application/json")
+        response = api.request_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+
+        self.assertEqual([(pref["id"], pref["population"]) for pref in response["prefectures"]], [(13, 1), (27, 2)])
+        self.assertEqual(Prefecture.objects.get(id=13).population, 1)
+        self.assertEqual(Prefecture.objects.get(id=27).capital, "架空市")
+        self.assertEqual(Prefecture.objects.get(id=27).name, "大阪府")
+
+    def test_put_index_not_found(self):
+        """存在しないIDはItemごとのエラーとする"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        api = ModelPrefectureJSONAPI()
+        api.allow_bulk_change = True
+        pref_data = [{"id": 27, "capital": "架空市", "population": 2},
+                     {"id": 100, "capital": "架空市", "population": 2}]
+        request = RequestFactory().put("/models/prefectures/", data=json.dumps({"prefectures": pref_data}),
+                                       content_type="application/json")
+        response = api.request_index(request)
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(response[0], {})
+        self.assertTrue("id" in response[1])
+        self.assertEqual(Prefecture.objects.get(id=27).population, 8856000)
+
+    def _get_memo_api(self, memo_model):
+        from django import forms
+        from jsonapi.models import ModelJSONAPI
+
+        class MemoForm(forms.ModelForm):
+            class Meta:
+                model = memo_model
+                fields = ("text", "is_done")
+
+        class MemoJSONAPI(ModelJSONAPI):
+            model = memo_model
+            model_name = "memos"
+            fields = ("id", "text", "is_done", "version")
+            change_form = MemoForm
+            allow_bulk_change = True
+
+        return MemoJSONAPI()
+
+    def _put_memos(self, api, method, memos):
+        from django.test.client import RequestFactory
+        request = getattr(RequestFactory(), method)("/memos/", data=json.dumps({"memos": memos}),
+                                                   content_type="application/json")
+        return api.request_index(request)
+
+    def test_put_index_auto_now(self):
+        """auto_nowのフィールドとsave()のオーバーライド"""
+        from django.test.client import RequestFactory
+        from django.utils import timezone
+        from jsonapi.tests.models import Memo, VersionedMemo
+        past = timezone.now() - datetime.timedelta(days=1)
+        memos = [Memo.objects.create(text="memo%d" % i) for i in range(3)]
+        Memo.objects.update(updated_at=past)
+
+        # bulk_updateでもauto_nowのフィールドを更新する
+        api = self._get_memo_api(Memo)
+        self.assertTrue(api._can_bulk_update(RequestFactory().put("/memos/")))
+        response = self._put_memos(api, "put", [{"id": memos[0].id, "text": "changed"},
+                                                {"id": memos[1].id, "text": "memo1"}])
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertTrue(Memo.objects.get(id=memos[0].id).updated_at > past)
+        self.assertEqual(Memo.objects.get(id=memos[1].id).updated_at, past)
+
+        # save()をオーバーライドしたモデルは1件ずつsave()する
+        api = self._get_memo_api(VersionedMemo)
+        response = self._put_memos(api, "put", [{"id": memos[1].id, "text": "changed"},
+                                                {"id": memos[2].id, "text": "changed"}])
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([memo["version"] for memo in response["memos"]], [1, 1])
+        self.assertEqual(Memo.objects.get(id=memos[2].id).version, 1)
+        self.assertTrue(Memo.objects.get(id=memos[2].id).updated_at > past)
+
+    def test_patch_index(self):
+        """PATCHではデータに含まれないフィールドを変更しない"""
+        from jsonapi.tests.models import Memo
+        memos = [Memo.objects.create(text="memo%d" % i, is_done=True) for i in range(2)]
+        api = self._get_memo_api(Memo)
+        response = self._put_memos(api, "patch", [{"id": memos[0].id, "text": "changed"},
+                                                  {"id": memos[1].id, "is_done": False}])
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual([(memo.text, memo.is_done) for memo in Memo.objects.order_by("id")],
+                         [("changed", True), ("memo1", False)])
+
+        # PUTでは含まれないフィールドも変更する
+        response = self._put_memos(api, "put", [{"id": memos[0].id, "text": "changed"}])
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertFalse(Memo.objects.get(id=memos[0].id).is_done)
+
+    def test_put_index_process_update_item(self):
+        """process_update_itemをオーバーライドした場合は1件ずつ呼び出す"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.models import Memo
+        memos = [Memo.objects.create(text="memo%d" % i) for i in range(2)]
+        api = self._get_memo_api(Memo)
+
+        class UpperMemoJSONAPI(type(api)):
+            def process_update_item(self, request, form):
+                item = form.save(commit=False)
+                item.text = item.text.upper()
+                item.save()
+                return item
+
+        api = UpperMemoJSONAPI()
+        self.assertFalse(api._can_bulk_update(RequestFactory().put("/memos/")))
+        response = self._put_memos(api, "put", [{"id": memos[0].id, "text": "changed"},
+                                                {"id": memos[1].id, "text": "memo1"}])
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual([memo.text for memo in Memo.objects.order_by("id")], ["CHANGED", "MEMO1"])
+
+    def test_put_index_duplicate_id(self):
+        """同じIDを含む場合は400"""
+        from jsonapi.tests.models import Memo
+        memo = Memo.objects.create(text="memo")
+        api = self._get_memo_api(Memo)
+        response = self._put_memos(api, "put", [{"id": memo.id, "text": "a"}, {"id": memo.id, "text": "b"}])
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+        self.assertEqual(Memo.objects.get(id=memo.id).text, "memo")
+
+    def test_delete_index(self):
+        """IDのリストでまとめて削除する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.models import User
+        from jsonapi.tests.views import ModelPrefectureJSONAPI, ModelUserJSONAPI
+        api = ModelUserJSONAPI()
+        api.allow_bulk_delete = True
+        request = RequestFactory().delete("/models/users/", data=json.dumps({"users": [1, 2, 3, 1000]}),
+                                          content_type="application/json")
+        response = api.request_index(request)
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["deleted"], 3)
+        self.assertEqual(User.objects.count(), 97)
+
+        # カスケードを伴う削除
+        api = ModelPrefectureJSONAPI()
+        api.allow_bulk_delete = True
+        user_count = User.objects.filter(prefecture=15).count()
+        request = RequestFactory().delete("/models/prefectures/", data=json.dumps({"prefectures": [15]}),
+                                          content_type="application/json")
+        response = api.request_index(request)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["deleted"], 1)
+        self.assertFalse(Prefecture.objects.filter(id=15).exists())
+        self.assertEqual(User.objects.count(), 97 - user_count)
+
+    def test_delete_index_filter(self):
+        """フィルタでまとめて削除する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.models import User
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        User.objects.all().delete()
+        api = ModelPrefectureJSONAPI()
+        api.allow_bulk_delete = True
+
+        response = api.request_index(RequestFactory().delete("/models/prefectures/"))
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
+        response = api.request_index(RequestFactory().delete("/models/prefectures/?population_gte=8856000"))
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["deleted"], 3)
+        self.assertEqual(Prefecture.objects.count(), 44)
+
+    def _get_page(self, api, params):
+        from django.test.client import RequestFactory
+        response = api.get_index(RequestFactory().get("/models/prefectures/", params))
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_pagenation_count_none(self):
+        """件数を数えないページネーション"""
+        from django.conf import settings
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.count_mode = "none"
+
+        response = self._get_page(api, {"per_page": 10, "page": 2})
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], list(range(11, 21)))
+        self.assertEqual(response["meta"], {"per_page": 10, "page": 2, "has_next": True})
+
+        response = self._get_page(api, {"per_page": 10, "page": 5, "sort": "-population"})
+        self.assertEqual(len(response["prefectures"]), 7)
+        self.assertFalse(response["meta"]["has_next"])
+        populations = [pref["population"] for pref in response["prefectures"]]
+        self.assertEqual(populations, sorted(populations, reverse=True))
+
+    def test_pagenation_count_cached(self):
+        """件数をキャッシュするページネーション"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.count_mode = "cached"
+        api._get_cache().clear()
+
+        with self.assertNumQueries(2):
+            response = self._get_page(api, {"per_page": 5, "page": 3})
+        self.assertEqual(response["meta"], {"total": 47, "per_page": 5, "page": 3})
+        self.assertEqual(response["prefectures"][0]["id"], 11)
+
+        # 2回目は件数のクエリを実行しない
+        with self.assertNumQueries(1):
+            response = self._get_page(api, {"per_page": 5, "page": 1000})
+        self.assertEqual(response["meta"], {"total": 47, "per_page": 5, "page": 1})
+
+        # フィルタが異なる場合は数え直す
+        with self.assertNumQueries(2):
+            response = self._get_page(api, {"per_page": 5, "population_gte": 8856000})
+        self.assertEqual(response["meta"]["total"], 3)
+
+    def test_pagenation_count_estimate(self):
+        """推定できないデータベースでは正確な件数を用いる"""
+        from django.conf import settings
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.count_mode = "estimate"
+        response = self._get_page(api, {"per_page": 5, "page": 2})
+        self.assertEqual(response["meta"], {"total": 47, "per_page": 5, "page": 2})
+
+    def test_get_index_fields(self):
+        """fieldsパラメータで指定したカラムだけを取得する"""
+        from django.conf import settings
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from jsonapi.tests.views import ModelUserJSONAPI
+        settings.DEBUG = False
+
+        class SexUserJSONAPI(ModelUserJSONAPI):
+            fields = ("id", "shimei", ("sex", "get_sex_display"))
+        api = SexUserJSONAPI()
+        self.assertEqual(api._get_value_columns(("id", "shimei")), ("id", "shimei"))
+
+        from django.test.client import RequestFactory
+        request = RequestFactory().get("/models/users/", {"fields": "shimei,id"})
+        with CaptureQueriesContext(connection) as queries:
+            response = api.get_index(request)
+        self.assertEqual(response.status_code, 200)
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(response["users"]), 100)
+        self.assertEqual(sorted(response["users"][0].keys()), ["id", "shimei"])
+        sql = queries.captured_queries[0]["sql"]
+        self.assertTrue("shimei" in sql)
+        self.assertFalse("birthdate" in sql)
+
+        request = RequestFactory().get("/models/users/", {"fields": "sex"})
+        response = json.loads(api.get_index(request).content.decode("utf-8"))
+        self.assertTrue(response["users"][0]["sex"] in ("男性", "女性"))
+
+    def test_get_index_include(self):
+        """include=で関連するデータをlinkedに含める"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.models import ModelJSONAPI
+        from jsonapi.tests.models import Carrier
+        from jsonapi.tests.views import ModelUserJSONAPI
+        settings.DEBUG = False
+
+        response = self.client.get("/models/users/", {"per_page": 10, "include": "prefecture"})
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = json.loads(response.content.decode("utf-8"))
+        prefecture_ids = sorted(set(user["prefecture"] for user in response["users"]))
+        linked = response["linked"]["prefecture"]
+        self.assertEqual([pref["id"] for pref in linked], prefecture_ids)
+        self.assertEqual(sorted(linked[0].keys()),
+                         ["capital", "id", "is_designated_by_ordinance", "is_od", "name", "population"])
+
+        class CarrierJSONAPI(ModelJSONAPI):
+            model = Carrier
+            fields = ("id", "name")
+
+        class CarrierUserJSONAPI(ModelUserJSONAPI):
+            includes = ("prefecture", ("carrier", CarrierJSONAPI()))
+        api = CarrierUserJSONAPI()
+
+        # 件数と一覧、参照先ごとに1回ずつ (IDは取得した行から求める)
+        request = RequestFactory().get("/models/users/", {"per_page": 10, "include": "carrier,prefecture"})
+        with self.assertNumQueries(4):
+            response = api.get_index(request)
+        response = json.loads(response.content.decode("utf-8"))
+        carrier_ids = sorted(set(user["carrier"] for user in response["users"] if user["carrier"]))
+        self.assertEqual([carrier["id"] for carrier in response["linked"]["carrier"]], carrier_ids)
+        self.assertEqual(list(response["linked"].keys()), ["carrier", "prefecture"])
+
+        api.fetch_values = False
+        with self.assertNumQueries(4):
+            expected = json.loads(api.get_index(request).content.decode("utf-8"))
+        self.assertEqual(response, expected)
+
+        response = self.client.get("/models/users/1/", {"include": "prefecture"})
+        response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([pref["id"] for pref in response["linked"]["prefecture"]],
+                         [response["users"]["prefecture"]])
+
+    def test_get_index_include_invalid(self):
+        """宣言されていないincludeは 400 BadRequest"""
+        from jsonapi.models import ModelJSONAPI
+        from jsonapi.tests.models import User
+        response = self.client.get("/models/users/", {"include": "carrier"})
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+        response = self.client.get("/models/prefectures/", {"include": "prefecture"})
+        self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
+        class InvalidUserJSONAPI(ModelJSONAPI):
+            model = User
+            includes = ("shimei",)
+        self.assertRaises(ImproperlyConfigured, InvalidUserJSONAPI)
+
+    def test_register_api(self):
+        """includesの参照先はregister_apiで登録したAPIを用いる"""
+        from django.test.client import RequestFactory
+        from jsonapi.models import register_api, get_api_for_model
+        from jsonapi.tests.models import Carrier
+        from jsonapi.tests.views import ModelPrefectureJSONAPI, ModelUserJSONAPI, model_prefectures
+
+        # 生成しただけのAPIは登録されない
+        other = ModelPrefectureJSONAPI()
+        self.assertTrue(get_api_for_model(Prefecture) is model_prefectures)
+        self.assertRaises(ImproperlyConfigured, register_api, other)
+        self.assertTrue(register_api(model_prefectures) is model_prefectures)
+
+        class CarrierUserJSONAPI(ModelUserJSONAPI):
+            includes = ("carrier",)
+        self.assertTrue(get_api_for_model(Carrier) is None)
+        request = RequestFactory().get("/models/users/", {"include": "carrier"})
+        self.assertRaises(ImproperlyConfigured, CarrierUserJSONAPI().get_index, request)
+
+    def test_metadata_per_request(self):
+        """ページネーションのmetaは他のリクエストに残らない"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.metadata = {"version": 1}
+
+        request = RequestFactory().get("/models/prefectures/", {"per_page": 5, "page": 2})
+        response = json.loads(api.get_index(request).content.decode("utf-8"))
+        self.assertEqual(response["meta"], {"version": 1, "total": 47, "per_page": 5, "page": 2})
+        self.assertEqual(api.metadata, {"version": 1})
+        self.assertTrue(api.get_context(request) is api.get_context(request))
+
+        request = RequestFactory().get("/models/prefectures/")
+        response = json.loads(api.get_index(request).content.decode("utf-8"))
+        self.assertEqual(response["meta"], {"version": 1})
+
+
+    def test_benchmark(self):
+        """ベンチマークが実行できる"""
+        from jsonapi.tests.management.commands.benchmark import run_benchmarks
+        # DEBUGでもレスポンスに実行したクエリを含めない
+        with self.settings(DEBUG=True):
+            report = run_benchmarks([10], 1)
+        results = dict((result["name"], result) for result in report["results"])
+        self.assertEqual(results["get_index"]["rows"], 10)
+        self.assertEqual(results["get_index"]["queries"], 1)
+        self.assertEqual(results["get_index_dict"]["queries"], 0)
+        self.assertTrue(results["put_item"]["median"] > 0)
+        self.assertTrue(results["put_item"]["bytes"] < 200, results["put_item"]["bytes"])
+        self.assertTrue(results["get_index"]["bytes"] < 2000, results["get_index"]["bytes"])
+
+
+    def test_instrumentation_queries(self):
+        """クエリの数と時間を計測する"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+        api = ModelPrefectureJSONAPI()
+        api.server_timing = True
+
+        request = RequestFactory().get("/models/prefectures/", {"per_page": 10})
+        response = api.request_index(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('db;dur=' in response["Server-Timing"])
+        self.assertTrue('desc="2 queries"' in response["Server-Timing"])
+        self.assertEqual(api.get_context(request).stats["rows"], 10)
+
+        # QuerySetはqueryの区間で評価し、serializeの区間ではクエリを実行しない
+        test = self
+        class SerializeJSONAPI(ModelPrefectureJSONAPI):
+            def _phase(self, request, name):
+                if name == "serialize":
+                    return test.assertNumQueries(0)
+                return super(SerializeJSONAPI, self)._phase(request, name)
+        for fetch_values in (True, False):
+            api = SerializeJSONAPI()
+            api.fetch_values = fetch_values
+            response = api.request_index(RequestFactory().get("/models/prefectures/", {"per_page": 10}))
+            self.assertEqual(response.status_code, 200)
+
+
+    def test_query_budget(self):
+        """クエリ数の制限"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.instrumentation import QueryBudgetExceeded
+        from jsonapi.tests.views import ModelUserJSONAPI
+        settings.DEBUG = False
+
+        class UnrelatedUserJSONAPI(ModelUserJSONAPI):
+            # 関連オブジェクトを行ごとのクエリで参照する
+            select_related = ()
+            fetch_values = False
+            max_queries_index = 2
+            max_queries_item = 1
+
+        api = UnrelatedUserJSONAPI()
+        with self.assertLogs("jsonapi", "WARNING"):
+            response = api.request_item(RequestFactory().get("/models/users/1/"), "1")
+        self.assertEqual(response["X-Query-Count"], "3")
+
+        api.query_budget_action = "raise"
+        request = RequestFactory().get("/models/users/", {"per_page": 5})
+        self.assertRaises(QueryBudgetExceeded, api.request_index, request)
+
+        # select_relatedで読み込めば制限内に収まる
+        api = ModelUserJSONAPI()
+        api.max_queries_index = 2
+        api.query_budget_action = "raise"
+        response = api.request_index(RequestFactory().get("/models/users/", {"per_page": 5}))
+        self.assertEqual(response["X-Query-Count"], "2")
+        # 制限していないリクエストにはヘッダを付けない
+        response = api.request_item(RequestFactory().get("/models/users/1/"), "1")
+        self.assertFalse(response.has_header("X-Query-Count"))
+
+    def test_query_budget_streaming(self):
+        """ストリーミングでは本文を送信しながらクエリを数える"""
+        from django.conf import settings
+        from django.test.client import RequestFactory
+        from jsonapi.instrumentation import Observer, QueryBudgetExceeded
+        from jsonapi.tests.views import ModelUserJSONAPI
+        settings.DEBUG = False
+
+        class RecordingObserver(Observer):
+            def __init__(self):
+                self.stats = []
+            def request_finished(self, api, request, context, response):
+                self.stats.append(dict(context.stats))
+
+        class UnrelatedUserJSONAPI(ModelUserJSONAPI):
+            select_related = ()
+            fetch_values = False
+            streaming = True
+            stream_chunk_size = 2
+            max_queries_index = 2
+
+        api = UnrelatedUserJSONAPI()
+        api.observers = (RecordingObserver(),)
+        response = api.request_index(RequestFactory().get("/models/users/", {"per_page": 5}))
+        self.assertFalse(response.has_header("X-Query-Count"))
+        with self.assertLogs("jsonapi", "WARNING"):
+            content = b"".join(response.streaming_content)
+        stats = api.observers[0].stats[0]
+        # ストリーミングしない場合と同じ数になる
+        api.streaming = False
+        with self.assertLogs("jsonapi", "WARNING"):
+            response = api.request_index(RequestFactory().get("/models/users/", {"per_page": 5}))
+        self.assertEqual(stats["queries"], int(response["X-Query-Count"]))
+        api.streaming = True
+        self.assertEqual(stats["bytes"], len(content))
+
+        api.query_budget_action = "raise"
+        response = api.request_index(RequestFactory().get("/models/users/", {"per_page": 5}))
+        self.assertRaises(QueryBudgetExceeded, b"".join, response.streaming_content)
+
+
+    def test_index_suggestions(self):
+        """filtersとorder_fieldsに必要な索引を提案する"""
+        from jsonapi.indexes import get_index_suggestions
+        from jsonapi.tests.models import User
+        from jsonapi.tests.views import ModelPrefectureJSONAPI, ModelUserJSONAPI
+
+        # nameはunique、population_gteはソートの索引の先頭で足りる
+        suggestions = get_index_suggestions([ModelPrefectureJSONAPI()])
+        self.assertEqual([(model, fields) for model, fields, reasons in suggestions], [
+            (Prefecture, ("population", "id")),
+            (Prefecture, ("is_od", "id")),
+        ])
+        self.assertEqual(suggestions[0][2], ["ModelPrefectureJSONAPI filter population_gte",
+                                             "ModelPrefectureJSONAPI sort population"])
+
+        class UserSortJSONAPI(ModelUserJSONAPI):
+            filters = ("prefecture", ("name", "shimei__icontains"), ("born", "birthdate__range"))
+            order_fields = ("id", ("prefecture_name", "prefecture__name"), ("pop", "prefecture__population"))
+        # 外部キーと主キーには索引があり、部分一致には索引を用いることができない
+        suggestions = get_index_suggestions([UserSortJSONAPI()])
+        self.assertEqual([(model, fields) for model, fields, reasons in suggestions], [
+            (User, ("birthdate",)),
+            (Prefecture, ("population",)),
+        ])
+
+    def test_index_command(self):
+        """索引の提案を出力する"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+
+        out = StringIO()
+        call_command("jsonapi_indexes", stdout=out)
+        self.assertTrue("tests.Prefecture: Meta." in out.getvalue())
+        self.assertTrue('"population", "id"' in out.getvalue())
+        self.assertRaises(CommandError, call_command, "jsonapi_indexes", fail=True, stdout=StringIO())
+
+    def test_router(self):
+        """ルーターはリソース名でAPIを選ぶ"""
+        try:
+            from django.urls import reverse
+        except ImportError:  # Django < 2.0
+            from django.core.urlresolvers import reverse
+        from jsonapi.tests.urls import router
+        from jsonapi.tests.views import prefectures, model_users
+
+        # idが全てintで同期のAPIは一括リクエストと2つのURLパターンにまとまる
+        self.assertEqual(len(router.urls), 3)
+        self.assertTrue(router.get_api("users") is model_users)
+        self.assertRaises(ImproperlyConfigured, router.register, prefectures, "other")
+
+        response = self.client.get("/router/prefectures/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content.decode("utf-8"))["prefectures"]), 47)
+        response = self.client.get("/router/model_prefectures/27/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["prefectures"]["id"], 27)
+        response = self.client.get("/router/users/", {"per_page": 5})
+        self.assertEqual(len(json.loads(response.content.decode("utf-8"))["users"]), 5)
+
+        self.assertEqual(self.client.get("/router/unknown/").status_code, 404)
+        self.assertEqual(self.client.get("/router/model_prefectures/x/").status_code, 404)
+        self.assertEqual(self.client.delete("/router/model_prefectures/27/").status_code, 202)
+        self.assertFalse(Prefecture.objects.filter(id=27).exists())
+
+        self.assertEqual(reverse("jsonapi_item", kwargs={"resource": "users", "id": 1}),
+                         "/router/users/1/")
+
+    def test_router_converters(self):
+        """idのコンバーターが異なるAPIは別のURLパターンになる"""
+        from jsonapi.routers import Router
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+
+        class NamePrefectureJSONAPI(ModelPrefectureJSONAPI):
+            def id_to_python(self, id_str):
+                return id_str
+
+        api = NamePrefectureJSONAPI()
+        self.assertEqual(self.prefecture_api.get_id_converter(), "int")
+        self.assertEqual(api.get_id_converter(), "str")
+
+        router = Router()
+        router.register(self.prefecture_api)
+        router.register(api, "names")
+        self.assertEqual(len(router.urls), 5)
+        self.assertRaises(ImproperlyConfigured, router.register, ModelPrefectureJSONAPI(), "more")
+
+    def _batch(self, data):
+        response = self.client.post("/router/batch/", data=json.dumps(data), content_type="application/json")
+        return response.status_code, json.loads(response.content.decode("utf-8"))["results"]
+
+    def test_batch(self):
+        """複数の操作を1つのリクエストで実行する"""
+        status, results = self._batch([
+            {"resource": "prefectures", "query": {"fields": "id,name"}},
+            {"method": "GET", "resource": "model_prefectures", "id": 27},
+            {"method": "GET", "resource": "users", "id": "x"},
+            {"method": "GET", "resource": "unknown"},
+            {"method": "POST", "resource": "model_prefectures",
+             "body": {"prefectures": [{"name": "架空県", "capital": "架空市", "population": 1}]}},
+            {"method": "DELETE", "resource": "model_prefectures", "id": 27},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual([result["status"] for result in results], [200, 200, 404, 404, 200, 202])
+        self.assertEqual(len(results[0]["body"]["prefectures"]), 47)
+        self.assertEqual(sorted(results[0]["body"]["prefectures"][0].keys()), ["id", "name"])
+        self.assertEqual(results[1]["body"]["prefectures"]["name"], "大阪府")
+        self.assertEqual(results[4]["body"]["prefectures"][0]["name"], "架空県")
+        self.assertEqual(results[5]["body"], None)
+        self.assertFalse(Prefecture.objects.filter(id=27).exists())
+
+        self.assertEqual(self.client.get("/router/batch/").status_code, 405)
+        for data in ({"operations": "x"}, [{"resource": "users", "method": "HEAD"}], [1],
+                     [{"resource": "users"}] * 51):
+            response = self.client.post("/router/batch/", data=json.dumps(data),
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 400, "Status Code is not 400")
+
+    def test_batch_body(self):
+        """一括リクエストのボディの大きさとデコーダ"""
+        from django.test.client import RequestFactory
+        from jsonapi.encoders import DECODERS
+        from jsonapi.routers import Router
+        from jsonapi.tests.views import prefectures
 
+        router = Router()
+        router.register(prefectures)
+        router.batch_max_body_size = 100
+        data = [{"resource": "prefectures", "id": 27}]
+        request = RequestFactory().post("/batch/", data=json.dumps(data), content_type="application/json")
+        self.assertEqual(router.batch(request).status_code, 200)
+        request = RequestFactory().post("/batch/", data=json.dumps(data * 5), content_type="application/json")
+        self.assertEqual(router.batch(request).status_code, 413)
 
+        for name, decoder in DECODERS.items():
+            if decoder is None:
+                continue
+            router.json_decoder = name
+            request = RequestFactory().post("/batch/", data=json.dumps(data), content_type="application/json")
+            self.assertEqual(router.batch(request).status_code, 200, name)
+
+    def test_batch_atomic(self):
+        """atomicの場合は失敗した操作までの変更を取り消す"""
+        def put(population):
+            return {"method": "PUT", "resource": "model_prefectures", "id": 27,
+                    "body": {"prefectures": {"id": 27, "capital": "大阪市", "population": population}}}
+
+        status, results = self._batch({"atomic": True, "operations": [put(1), put("x"), put(3)]})
+        self.assertEqual(status, 400)
+        self.assertEqual([result["status"] for result in results], [200, 400])
+        self.assertNotEqual(Prefecture.objects.get(id=27).population, 1)
+
+        # atomicでなければ成功した操作は取り消さない
+        status, results = self._batch([put(1), put("x"), put(3)])
+        self.assertEqual([result["status"] for result in results], [200, 400, 200])
+        self.assertEqual(Prefecture.objects.get(id=27).population, 3)
+
+    def test_batch_atomic_cache(self):
+        """atomicの操作はキャッシュせず、コミットした後にキャッシュを無効にする"""
+        from django.test.client import RequestFactory
+        from jsonapi.routers import Router
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+
+        class CachedPrefectureJSONAPI(ModelPrefectureJSONAPI):
+            cache_timeout = 60
+
+        api = CachedPrefectureJSONAPI()
+        api._get_cache().clear()
+        router = Router()
+        router.register(api, "prefectures")
+
+        def batch(operations):
+            request = RequestFactory().post("/batch/", data=json.dumps({"atomic": True, "operations": operations}),
+                                            content_type="application/json")
+            with run_on_commit(self):
+                return router.batch(request)
+
+        def put(capital, population=1):
+            return {"method": "PUT", "resource": "prefectures", "id": 27,
+                    "body": {"prefectures": {"id": 27, "capital": capital, "population": population}}}
+
+        def get_capital():
+            response = api.request_item(RequestFactory().get("/prefectures/27/"), "27")
+            return json.loads(response.content.decode("utf-8"))["prefectures"]["capital"]
+
+        self.assertEqual(get_capital(), "大阪市")
+        response = batch([put("GHOST"), {"resource": "prefectures", "id": 27}, put("GHOST", "x")])
+        self.assertEqual(response.status_code, 400)
+        results = json.loads(response.content.decode("utf-8"))["results"]
+        self.assertEqual(results[1]["body"]["prefectures"]["capital"], "GHOST")
+        # 取り消した変更をキャッシュから返さない
+        self.assertEqual(Prefecture.objects.get(id=27).capital, "大阪市")
+        self.assertEqual(get_capital(), "大阪市")
+
+        response = batch([put("架空市"), {"resource": "prefectures", "id": 27}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_capital(), "架空市")
+
+    def test_cache_shared_by_model(self):
+        """同じモデルのAPIは変更によるキャッシュの無効化を共有する"""
+        from django.test.client import RequestFactory
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+
+        class CachedPrefectureJSONAPI(ModelPrefectureJSONAPI):
+            cache_timeout = 60
+
+        class NamePrefectureJSONAPI(CachedPrefectureJSONAPI):
+            fields = ("id", "name", "capital")
+
+        api, other = CachedPrefectureJSONAPI(), NamePrefectureJSONAPI()
+        api._get_cache().clear()
+        self.assertNotEqual(api.get_cache_prefix(), other.get_cache_prefix())
+        self.assertEqual(api.get_cache_version_namespace(), other.get_cache_version_namespace())
+
+        factory = RequestFactory()
+        response = other.request_item(factory.get("/prefectures/27/"), "27")
+        etag = response["ETag"]
+        response = other.request_item(factory.get("/prefectures/27/", HTTP_IF_NONE_MATCH=etag), "27")
+        self.assertEqual(response.status_code, 304, "Status Code is not 304")
+
+        body = {"prefectures": {"id": 27, "capital": "架空市", "population": 1}}
+        with run_on_commit(self):
+            response = api.request_item(factory.put("/prefectures/27/", data=json.dumps(body),
+                                                    content_type="application/json"), "27")
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        response = other.request_item(factory.get("/prefectures/27/", HTTP_IF_NONE_MATCH=etag), "27")
+        self.assertEqual(response.status_code, 200, "Status Code is not 200")
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["prefectures"]["capital"], "架空市")
+
+    def test_batch_workers(self):
+        """GETだけの一括リクエストをスレッドで並列に実行する"""
+        from django.test.client import RequestFactory
+        from jsonapi.routers import Router
+        from jsonapi.tests.views import prefectures
+
+        router = Router()
+        router.batch_workers = 4
+        router.register(prefectures)
+        data = [{"resource": "prefectures", "id": id} for id in range(1, 11)]
+        request = RequestFactory().post("/batch/", data=json.dumps(data), content_type="application/json")
+        response = router.batch(request)
+        results = json.loads(response.content.decode("utf-8"))["results"]
+        self.assertEqual([result["body"]["prefectures"]["id"] for result in results], list(range(1, 11)))
+
+        # ユーザーとセッションはワーカーに渡す前に読み込む
+        import threading
+        from django.utils.functional import SimpleLazyObject
+        threads = []
+        class User(object):
+            pk = None
+        def get_user():
+            threads.append(threading.current_thread())
+            return User()
+
+        class Session(dict):
+            def keys(self):
+                threads.append(threading.current_thread())
+                return super(Session, self).keys()
+
+        request = RequestFactory().post("/batch/", data=json.dumps(data), content_type="application/json")
+        request.user = SimpleLazyObject(get_user)
+        request.session = Session()
+        response = router.batch(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+
+    @skipIf(django.VERSION < (1, 7), "System checks require Django >= 1.7")
+    def test_index_check(self):
+        """システムチェックで索引がないことを警告する"""
+        from django.core import checks
+        warnings = [w for w in checks.run_checks(tags=["jsonapi"]) if w.obj is Prefecture]
+        self.assertTrue(warnings)
+        self.assertEqual(warnings[0].id, "jsonapi.W001")
+
+
+@skipIf(django.VERSION < (4, 2), "Async ORM requires Django >= 4.2")
+class AsyncModelJSONAPITest(TestCase):
+    fixtures = ['prefecture.json', 'carrier.json', 'user.json']
+
+    def setUp(self):
+        from django.conf import settings
+        from jsonapi.asyncapi import AsyncModelJSONAPI
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        settings.DEBUG = False
+
+        class AsyncPrefectureJSONAPI(AsyncModelJSONAPI, ModelPrefectureJSONAPI):
+            pass
+        self.api = AsyncPrefectureJSONAPI()
+
+    def _call(self, view, request, *args, **kwargs):
+        from asgiref.sync import async_to_sync
+        response = async_to_sync(view)(request, *args, **kwargs)
+        if response.streaming:
+            async def consume():
+                return b"".join([chunk async for chunk in response.streaming_content])
+            return response.status_code, json.loads(async_to_sync(consume)().decode("utf-8"))
+        if response.status_code != 200:
+            return response.status_code, None
+        return response.status_code, json.loads(response.content.decode("utf-8"))
+
+    def test_get_index(self):
+        """非同期での一覧の取得"""
+        from django.test.client import RequestFactory
+        request = RequestFactory().get("/models/prefectures/", {"per_page": 5, "page": 3, "sort": "-population"})
+        status, response = self._call(self.api.request_index, request)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(response["prefectures"]), 5)
+        self.assertEqual(response["meta"], {"total": 47, "per_page": 5, "page": 3})
+
+        from jsonapi.tests.views import ModelPrefectureJSONAPI
+        expected = json.loads(ModelPrefectureJSONAPI().get_index(request).content.decode("utf-8"))
+        self.assertEqual(response, expected)
+
+    def test_router(self):
+        """非同期のAPIは同期のAPIと別の非同期のビューになる"""
+        from inspect import iscoroutinefunction
+        from django.test.client import RequestFactory
+        from django.urls import resolve
+        from jsonapi.routers import Router
+        from jsonapi.tests.views import model_users
+
+        router = Router()
+        router.register(self.api)
+        router.register(model_users)
+        urlconf = type("urlconf", (object,), {"urlpatterns": router.urls})
+        match = resolve("/prefectures/27/", urlconf)
+        self.assertTrue(iscoroutinefunction(match.func))
+        self.assertFalse(iscoroutinefunction(resolve("/users/1/", urlconf).func))
+
+        status, response = self._call(match.func, RequestFactory().get("/prefectures/27/"), *match.args,
+                                      **match.kwargs)
+        self.assertEqual(status, 200)
+        self.assertEqual(response["prefectures"]["id"], 27)
+
+        # 一括リクエストでは非同期のAPIの結果を待つ
+        data = [{"resource": "prefectures", "id": 27}, {"resource": "users", "id": 1}]
+        request = RequestFactory().post("/batch/", data=json.dumps(data), content_type="application/json")
+        results = json.loads(router.batch(request).content.decode("utf-8"))["results"]
+        self.assertEqual(results[0]["body"]["prefectures"]["id"], 27)
+        self.assertEqual(results[1]["body"]["users"]["id"], 1)
+
+    def test_get_index_streaming_cursor(self):
+        """非同期でのストリーミングとカーソルによるページネーション"""
+        from django.test.client import RequestFactory
+        self.api.streaming = True
+        self.api.stream_chunk_size = 2
+        self.api.cursor_pagination = True
+        ids = []
+        params = {"per_page": 20}
+        while True:
+            request = RequestFactory().get("/models/prefectures/", params)
+            status, response = self._call(self.api.request_index, request)
+            ids.extend(pref["id"] for pref in response["prefectures"])
+            if response["meta"]["next"] is None:
+                break
+            params["cursor"] = response["meta"]["next"]
+        self.assertEqual(ids, list(range(1, 48)))
+
+        # モデルのインスタンスはaiterator()で取得する
+        self.api.fetch_values = False
+        self.api.cursor_pagination = False
+        status, response = self._call(self.api.request_index, RequestFactory().get("/models/prefectures/"))
+        self.assertEqual([pref["id"] for pref in response["prefectures"]], list(range(1, 48)))
+
+    def test_serialize_instances(self):
+        """モデルのインスタンスは関連するオブジェクトを取得するためスレッドでシリアライズする"""
+        from django.test.client import RequestFactory
+        from jsonapi.asyncapi import AsyncModelJSONAPI
+        from jsonapi.tests.models import User
+
+        class AsyncUserJSONAPI(AsyncModelJSONAPI):
+            model = User
+            fields = ("id", ("pname", "prefecture__name"))
+            fetch_values = False
+            select_related = ()
+
+        api = AsyncUserJSONAPI()
+        expected = [(user.id, user.prefecture.name) for user in User.objects.order_by("id")]
+        for streaming in (False, True):
+            api.streaming = streaming
+            status, response = self._call(api.request_index, RequestFactory().get("/"))
+            self.assertEqual(status, 200)
+            self.assertEqual([(user["id"], user["pname"]) for user in response["users"]], expected)
+
+        status, response = self._call(api.request_item, RequestFactory().get("/"), expected[0][0])
+        self.assertEqual(response["users"]["pname"], expected[0][1])
+
+    def test_get_item(self):
+        """非同期での1件の取得"""
+        from django.test.client import RequestFactory
+        status, response = self._call(self.api.request_item, RequestFactory().get("/"), 27)
+        self.assertEqual(status, 200)
+        self.assertEqual(response["prefectures"]["name"], "大阪府")
+
+        from django.http import Http404
+        self.assertRaises(Http404, self._call, self.api.request_item, RequestFactory().get("/"), 100)
+
+    def test_instrumentation(self):
+        """非同期でのServer-Timingヘッダ"""
+        from django.test.client import RequestFactory
+        from asgiref.sync import async_to_sync
+        self.api.server_timing = True
+        response = async_to_sync(self.api.request_index)(RequestFactory().get("/"))
+        metrics = [metric.split(";")[0] for metric in response["Server-Timing"].split(", ")]
+        self.assertEqual(metrics, ["query", "serialize", "encode", "db", "total"])
+
+    def test_query_budget(self):
+        """非同期でのクエリ数の制限"""
+        from django.test.client import RequestFactory
+        from asgiref.sync import async_to_sync
+        from jsonapi.instrumentation import QueryBudgetExceeded
+        self.api.max_queries_index = 1
+        self.api.query_budget_action = "raise"
+        request = RequestFactory().get("/", {"per_page": 5})
+        self.assertRaises(QueryBudgetExceeded, async_to_sync(self.api.request_index), request)
+
+        self.api.max_queries_index = 2
+        response = async_to_sync(self.api.request_index)(RequestFactory().get("/", {"per_page": 5}))
+        self.assertEqual(response["X-Query-Count"], "2")
+
+        # ストリーミングでは本文を送信し終えた時点で判定する
+        self.api.streaming = True
+        self.api.max_queries_index = 1
+        response = async_to_sync(self.api.request_index)(RequestFactory().get("/", {"per_page": 5}))
+        self.assertFalse(response.has_header("X-Query-Count"))
+
+        async def consume():
+            return [chunk async for chunk in response.streaming_content]
+        self.assertRaises(QueryBudgetExceeded, async_to_sync(consume))
+
+    def test_post_put_delete(self):
+        """非同期での追加・変更・削除"""
+        from django.test.client import RequestFactory
+        factory = RequestFactory()
+        data = {"prefectures": {"name": "テスト", "capital": "テスト市", "population": 100}}
+        request = factory.post("/", data=json.dumps(data), content_type="application/json")
+        status, response = self._call(self.api.request_index, request)
+        self.assertEqual(status, 200)
+        id = response["prefectures"][0]["id"]
+
+        data = {"prefectures": {"id": id, "capital": "テスト市", "population": 200}}
+        request = factory.put("/", data=json.dumps(data), content_type="application/json")
+        status, response = self._call(self.api.request_item, request, id)
+        self.assertEqual(status, 200)
+        self.assertEqual(Prefecture.objects.get(id=id).population, 200)
+
+        status, response = self._call(self.api.request_item, factory.delete("/"), id)
+        self.assertEqual(status, 202)
+        self.assertFalse(Prefecture.objects.filter(id=id).exists())
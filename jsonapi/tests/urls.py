@@ -1,8 +1,19 @@
-from django.conf.urls import patterns, include, url
-from jsonapi.tests.views import prefectures, model_prefectures
+try:
+    from django.urls import include, re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import include, url
+from jsonapi.routers import Router
+from jsonapi.tests.views import prefectures, model_prefectures, model_users
 
 
-urlpatterns = patterns('',
-    (r'^prefectures/', include(prefectures.urls)),
-    (r'^models/prefectures/', include(model_prefectures.urls)),
-)
+router = Router()
+router.register(prefectures)
+router.register(model_prefectures, "model_prefectures")
+router.register(model_users)
+
+urlpatterns = [
+    url(r'^prefectures/', include(prefectures.urls)),
+    url(r'^models/prefectures/', include(model_prefectures.urls)),
+    url(r'^models/users/', include(model_users.urls)),
+    url(r'^router/', include(router.urls)),
+]
@@ -3,8 +3,8 @@ import jsonapi
 from jsonapi.tests.dictdata import PrefectureData
 from jsonapi.tests.forms import AddPrefectureForm, ChangePrefectureForm, \
     ModelAddPrefectureForm, ModelChangePrefectureForm
-from jsonapi.models import ModelJSONAPI
-from jsonapi.tests.models import Prefecture
+from jsonapi.models import ModelJSONAPI, register_api
+from jsonapi.tests.models import Prefecture, User
 
 
 
@@ -38,5 +38,15 @@ class ModelPrefectureJSONAPI(ModelJSONAPI):
     add_form = ModelAddPrefectureForm
     change_form = ModelChangePrefectureForm
 
-model_prefectures = ModelPrefectureJSONAPI()
+model_prefectures = register_api(ModelPrefectureJSONAPI())
 
+
+class ModelUserJSONAPI(ModelJSONAPI):
+    model = User
+    fields = (
+              "id", "shimei", "birthdate", "prefecture",
+              ("prefecture_name", "prefecture__name"), "carrier",
+              )
+    includes = ("prefecture",)
+
+model_users = ModelUserJSONAPI()
@@ -5,7 +5,7 @@ from distutils.core import setup
 
 setup(
       name="django-jsonapi-org",
-      packages=["jsonapi"],
+      packages=["jsonapi", "jsonapi.management", "jsonapi.management.commands"],
       version = "0.5.1",
       description="JSON API implementation for use with django",
       author="Youta EGUSA",